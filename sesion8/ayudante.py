@@ -1,12 +1,32 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from struct import Struct
+from time import perf_counter
 from unittest import TestCase, TestSuite, TextTestRunner
 
 import hashlib
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 SIGHASH_ALL = 1
 SIGHASH_NONE = 2
 SIGHASH_SINGLE = 3
+U16 = Struct('<H')
+U32 = Struct('<I')
+U64 = Struct('<Q')
 ALFABETO_BASE58 = b'123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+# traduce cada carácter base58 a su valor; los que no son del alfabeto a 0xff
+TABLA_BASE58 = bytes(ALFABETO_BASE58.find(b) % 256 for b in range(256))
+# los dos caracteres (menos significativo primero) de cada número de 0 a 58**2 - 1
+PARES_BASE58 = [bytes((ALFABETO_BASE58[n % 58], ALFABETO_BASE58[n // 58])) for n in range(58 * 58)]
+# las conversiones con el entero grande se hacen de 10 en 10 dígitos
+DÍGITOS_TROZO_BASE58 = 10
+TROZO_BASE58 = 58**DÍGITOS_TROZO_BASE58
 
 
 def ejecutar_prueba(test):
@@ -39,30 +59,227 @@ def int_a_little_endian(n, long):
     return n.to_bytes(long, 'little')
 
 
+# constantes de RIPEMD-160: palabra del bloque (R) y rotación (S) de cada uno de
+# los 80 pasos de la línea izquierda y de la derecha
+R_IZQ_RIPEMD160 = (
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+    7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
+    3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12,
+    1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
+    4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13)
+R_DER_RIPEMD160 = (
+    5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12,
+    6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
+    15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13,
+    8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
+    12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11)
+S_IZQ_RIPEMD160 = (
+    11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8,
+    7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
+    11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5,
+    11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
+    9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6)
+S_DER_RIPEMD160 = (
+    8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6,
+    9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
+    9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5,
+    15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
+    8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11)
+K_IZQ_RIPEMD160 = (0x00000000, 0x5a827999, 0x6ed9eba1, 0x8f1bbcdc, 0xa953fd4e)
+K_DER_RIPEMD160 = (0x50a28be6, 0x5c4dd124, 0x6d703ef3, 0x7a6d76e9, 0x00000000)
+# los pasos de cada ronda ya agrupados: (palabra, rotación, 32 - rotación) de
+# la izquierda seguidos de los mismos de la derecha
+PASOS_RIPEMD160 = [
+    [(R_IZQ_RIPEMD160[i], S_IZQ_RIPEMD160[i], 32 - S_IZQ_RIPEMD160[i],
+      R_DER_RIPEMD160[i], S_DER_RIPEMD160[i], 32 - S_DER_RIPEMD160[i])
+     for i in range(16 * ronda, 16 * ronda + 16)]
+    for ronda in range(5)]
+ESTADO_INICIAL_RIPEMD160 = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0)
+BLOQUE_RIPEMD160 = Struct('<16I')
+U32X5 = Struct('<5I')
+MÁSCARA_32 = 0xffffffff
+
+
+def comprimir_ripemd160(estado, x):
+    '''Aplica la función de compresión de RIPEMD-160 al estado con las 16
+    palabras x del bloque. Devuelve el estado nuevo'''
+    M = MÁSCARA_32
+    h0, h1, h2, h3, h4 = estado
+    al, bl, cl, dl, el = estado
+    ar, br, cr, dr, er = estado
+    # cada ronda tiene su propio bucle para no elegir la función en cada paso;
+    # ~ da enteros negativos, pero el & M del final deja el resultado bien
+    pasos1, pasos2, pasos3, pasos4, pasos5 = PASOS_RIPEMD160
+    ki, kd = K_IZQ_RIPEMD160[0], K_DER_RIPEMD160[0]
+    for i, s, si, j, t, tj in pasos1:
+        a = (al + (bl ^ cl ^ dl) + x[i] + ki) & M
+        al, bl, cl, dl, el = el, ((a << s | a >> si) + el) & M, bl, (cl << 10 | cl >> 22) & M, dl
+        a = (ar + (br ^ (cr | ~dr)) + x[j] + kd) & M
+        ar, br, cr, dr, er = er, ((a << t | a >> tj) + er) & M, br, (cr << 10 | cr >> 22) & M, dr
+    ki, kd = K_IZQ_RIPEMD160[1], K_DER_RIPEMD160[1]
+    for i, s, si, j, t, tj in pasos2:
+        a = (al + (dl ^ (bl & (cl ^ dl))) + x[i] + ki) & M
+        al, bl, cl, dl, el = el, ((a << s | a >> si) + el) & M, bl, (cl << 10 | cl >> 22) & M, dl
+        a = (ar + (cr ^ (dr & (br ^ cr))) + x[j] + kd) & M
+        ar, br, cr, dr, er = er, ((a << t | a >> tj) + er) & M, br, (cr << 10 | cr >> 22) & M, dr
+    ki, kd = K_IZQ_RIPEMD160[2], K_DER_RIPEMD160[2]
+    for i, s, si, j, t, tj in pasos3:
+        a = (al + ((bl | ~cl) ^ dl) + x[i] + ki) & M
+        al, bl, cl, dl, el = el, ((a << s | a >> si) + el) & M, bl, (cl << 10 | cl >> 22) & M, dl
+        a = (ar + ((br | ~cr) ^ dr) + x[j] + kd) & M
+        ar, br, cr, dr, er = er, ((a << t | a >> tj) + er) & M, br, (cr << 10 | cr >> 22) & M, dr
+    ki, kd = K_IZQ_RIPEMD160[3], K_DER_RIPEMD160[3]
+    for i, s, si, j, t, tj in pasos4:
+        a = (al + (cl ^ (dl & (bl ^ cl))) + x[i] + ki) & M
+        al, bl, cl, dl, el = el, ((a << s | a >> si) + el) & M, bl, (cl << 10 | cl >> 22) & M, dl
+        a = (ar + (dr ^ (br & (cr ^ dr))) + x[j] + kd) & M
+        ar, br, cr, dr, er = er, ((a << t | a >> tj) + er) & M, br, (cr << 10 | cr >> 22) & M, dr
+    ki, kd = K_IZQ_RIPEMD160[4], K_DER_RIPEMD160[4]
+    for i, s, si, j, t, tj in pasos5:
+        a = (al + (bl ^ (cl | ~dl)) + x[i] + ki) & M
+        al, bl, cl, dl, el = el, ((a << s | a >> si) + el) & M, bl, (cl << 10 | cl >> 22) & M, dl
+        a = (ar + (br ^ cr ^ dr) + x[j] + kd) & M
+        ar, br, cr, dr, er = er, ((a << t | a >> tj) + er) & M, br, (cr << 10 | cr >> 22) & M, dr
+    return (
+        (h1 + cl + dr) & M,
+        (h2 + dl + er) & M,
+        (h3 + el + ar) & M,
+        (h4 + al + br) & M,
+        (h0 + bl + cr) & M,
+    )
+
+
+def ripemd160_python(s):
+    '''RIPEMD-160 en Python puro, para cuando hashlib no lo trae (OpenSSL 3)'''
+    longitud = len(s)
+    # relleno: 0x80, ceros hasta 56 bytes módulo 64 y la longitud en bits
+    s = bytes(s) + b'\x80' + bytes((55 - longitud) % 64) + U64.pack(longitud * 8 & 0xffffffffffffffff)
+    estado = ESTADO_INICIAL_RIPEMD160
+    # las entradas de hash160 (32 bytes) caben en un único bloque
+    for inicio in range(0, len(s), 64):
+        estado = comprimir_ripemd160(estado, BLOQUE_RIPEMD160.unpack_from(s, inicio))
+    return U32X5.pack(*estado)
+
+
+def ripemd160_hashlib(s):
+    return hashlib.new('ripemd160', s).digest()
+
+
+# implementaciones entre las que se elige al importar, de más a menos probable
+CANDIDATAS_RIPEMD160 = (ripemd160_hashlib, ripemd160_python)
+VECTOR_RIPEMD160 = (b'abc', bytes.fromhex('8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'))
+REPETICIONES_SONDEO_RIPEMD160 = 20
+
+
+def elegir_ripemd160(candidatas=CANDIDATAS_RIPEMD160):
+    '''Devuelve la más rápida de las implementaciones de RIPEMD-160 que
+    funcionan y dan el resultado correcto'''
+    entrada, esperado = VECTOR_RIPEMD160
+    mejor, mejor_tiempo = None, None
+    for función in candidatas:
+        try:
+            if función(entrada) != esperado:
+                continue
+        except ValueError:
+            # hashlib.new lanza ValueError si OpenSSL no tiene el algoritmo
+            continue
+        inicio = perf_counter()
+        for _ in range(REPETICIONES_SONDEO_RIPEMD160):
+            función(entrada)
+        tiempo = perf_counter() - inicio
+        if mejor_tiempo is None or tiempo < mejor_tiempo:
+            mejor, mejor_tiempo = función, tiempo
+    if mejor is None:
+        raise RuntimeError('ninguna implementación de RIPEMD-160 funciona')
+    return mejor
+
+
+ripemd160 = elegir_ripemd160()
+
+
 def hash160(s):
-    return hashlib.new('ripemd160', hashlib.sha256(s).digest()).digest()
+    return ripemd160(hashlib.sha256(s).digest())
 
 
 def doble_sha256(s):
     return hashlib.sha256(hashlib.sha256(s).digest()).digest()
 
 
+# hashlib suelta el GIL con entradas de al menos este tamaño: con entradas así
+# merece la pena usar hilos. Con entradas más pequeñas no se ha medido que los
+# procesos ganen a la serie, así que solo se usan si se piden explícitamente
+TAMAÑO_GIL_HASHLIB = 2048
+# por debajo de este número de entradas se hashea en serie
+MÍNIMO_LOTE_PARALELO = 4096
+# entradas que se envían juntas a cada hilo o proceso
+TAMAÑO_TROZO_HASH = 1024
+
+
+def doble_sha256_trozo(trozo):
+    return [doble_sha256(s) for s in trozo]
+
+
+def hash160_trozo(trozo):
+    return [hash160(s) for s in trozo]
+
+
+def hashear_lote(función_trozo, datos, modo=None, trabajadores=None,
+                 tamaño_trozo=TAMAÑO_TROZO_HASH, mínimo_paralelo=MÍNIMO_LOTE_PARALELO):
+    '''Aplica función_trozo a los datos por trozos y devuelve los resultados en orden.
+    modo es 'serie', 'hilos' o 'procesos'; si es None se usan hilos con muchas
+    entradas grandes y varios núcleos, y si no, serie'''
+    datos = list(datos)
+    if modo is None:
+        if (len(datos) >= mínimo_paralelo and (trabajadores or os.cpu_count() or 1) > 1
+                and sum(len(s) for s in datos) >= TAMAÑO_GIL_HASHLIB * len(datos)):
+            modo = 'hilos'
+        else:
+            modo = 'serie'
+    if modo == 'serie':
+        return función_trozo(datos)
+    elif modo == 'hilos':
+        ejecutor = ThreadPoolExecutor(max_workers=trabajadores)
+    elif modo == 'procesos':
+        ejecutor = ProcessPoolExecutor(max_workers=trabajadores)
+    else:
+        raise ValueError('modo desconocido: {}'.format(modo))
+    trozos = [datos[i:i + tamaño_trozo] for i in range(0, len(datos), tamaño_trozo)]
+    res = []
+    with ejecutor:
+        # map devuelve los resultados en el orden de los trozos
+        for resultados in ejecutor.map(función_trozo, trozos):
+            res.extend(resultados)
+    return res
+
+
+def doble_sha256_lote(datos, modo=None, trabajadores=None):
+    '''Devuelve la lista de doble_sha256 de cada elemento de datos'''
+    return hashear_lote(doble_sha256_trozo, datos, modo, trabajadores)
+
+
+def hash160_lote(datos, modo=None, trabajadores=None):
+    '''Devuelve la lista de hash160 de cada elemento de datos'''
+    return hashear_lote(hash160_trozo, datos, modo, trabajadores)
+
+
 def codificar_base58(s):
     # determina con cuántos 0 bytes (b'\x00') comienza s
-    contador = 0
-    for c in s:
-        if c == 0:
-            contador += 1
-        else:
-            break
+    contador = len(s) - len(s.lstrip(b'\x00'))
     prefijo = b'1' * contador
-    # convierte desde binario a hex, luego de hex a entero
-    num = int(s.hex(), 16)
+    num = int.from_bytes(s, 'big')
+    # los dígitos salen de menos a más significativo: se dan la vuelta al final
     res = bytearray()
     while num > 0:
-        num, mod = divmod(num, 58)
-        res.insert(0, ALFABETO_BASE58[mod])
-
+        # una sola división del entero grande por cada trozo de dígitos
+        num, trozo = divmod(num, TROZO_BASE58)
+        # y el trozo se pasa a caracteres de dos en dos
+        for _ in range(DÍGITOS_TROZO_BASE58 // 2):
+            trozo, mod = divmod(trozo, 58 * 58)
+            res += PARES_BASE58[mod]
+    # el último trozo deja ceros a la izquierda que no forman parte del número
+    while res and res[-1] == ALFABETO_BASE58[0]:
+        res.pop()
+    res.reverse()
     return prefijo + bytes(res)
 
 
@@ -76,16 +293,49 @@ def codificar_base58_checksum(bruto):
     return base58.decode('ascii')
 
 
-def decodificar_base58(s):
+def decodificar_base58_bruto(s):
+    '''Decodifica una cadena base58 de cualquier longitud. No comprueba checksum'''
+    b = s.encode('ascii')
+    # cada '1' del principio es un byte 0
+    contador = len(b) - len(b.lstrip(b'1'))
+    dígitos = b.translate(TABLA_BASE58)
+    if 0xff in dígitos:
+        raise ValueError('carácter no base58: {}'.format(chr(b[dígitos.index(0xff)])))
     num = 0
-    for c in s.encode('ascii'):
-        num *= 58
-        num += ALFABETO_BASE58.index(c)
-    combinado = num.to_bytes(25, byteorder='big')
+    for i in range(0, len(dígitos), DÍGITOS_TROZO_BASE58):
+        trozo = dígitos[i:i + DÍGITOS_TROZO_BASE58]
+        valor = 0
+        for dígito in trozo:
+            valor = valor * 58 + dígito
+        # una sola multiplicación del entero grande por cada trozo de dígitos
+        num = num * 58**len(trozo) + valor
+    return b'\x00' * contador + num.to_bytes((num.bit_length() + 7) // 8, 'big')
+
+
+def decodificar_base58_checksum(s):
+    '''Decodifica una cadena base58 con checksum y devuelve los bytes sin el checksum'''
+    combinado = decodificar_base58_bruto(s)
     checksum = combinado[-4:]
-    if doble_sha256(combinado[:-4])[:4] != checksum:
-        raise RuntimeError('dirección mala: {} {}'.format(checksum, doble_sha256(combinado)[:4]))
-    return combinado[1:-4]
+    if len(combinado) < 4 or doble_sha256(combinado[:-4])[:4] != checksum:
+        raise RuntimeError('dirección mala: {} {}'.format(checksum, doble_sha256(combinado[:-4])[:4]))
+    return combinado[:-4]
+
+
+def decodificar_base58(s):
+    '''Devuelve el hash160 de una dirección base58 (sin prefijo ni checksum)'''
+    return decodificar_base58_checksum(s)[1:]
+
+
+def codificar_base58_lote(brutos):
+    '''Codifica una lista de brutos en base58 con checksum'''
+    codificar = codificar_base58_checksum
+    return [codificar(bruto) for bruto in brutos]
+
+
+def decodificar_base58_lote(dires):
+    '''Devuelve la lista de hash160 de una lista de direcciones base58'''
+    decodificar = decodificar_base58_checksum
+    return [decodificar(dire)[1:] for dire in dires]
 
 
 def read_varint(s):
@@ -105,6 +355,171 @@ def read_varint(s):
         return i
 
 
+class LectorBytes:
+    '''Cursor sobre un buffer. Lee los campos directamente del buffer
+    con struct.unpack_from sin crear un bytes intermedio por campo'''
+
+    __slots__ = ('datos', 'vista', 'posición')
+
+    def __init__(self, datos, posición=0):
+        self.vista = memoryview(datos)
+        # un buffer mutable (bytearray) se copia: los memoryview que devuelve
+        # read_vista lo bloquearían y verían los cambios que se le hagan
+        if not self.vista.readonly:
+            datos = bytes(self.vista)
+            self.vista.release()
+            self.vista = memoryview(datos)
+        # con bytes se corta directamente: cada read hace una sola copia
+        if isinstance(datos, bytes):
+            self.datos = datos
+        else:
+            self.datos = self.vista
+        self.posición = posición
+
+    def restantes(self):
+        '''Devuelve cuántos bytes quedan por leer'''
+        return len(self.datos) - self.posición
+
+    def read_vista(self, n):
+        '''Devuelve los siguientes n bytes como memoryview, sin copiarlos'''
+        inicio = self.posición
+        self.posición = min(inicio + n, len(self.datos))
+        return self.vista[inicio:self.posición]
+
+    def read(self, n):
+        '''Como BytesIO.read: devuelve los siguientes n bytes (o los que queden)'''
+        inicio = self.posición
+        trozo = self.datos[inicio:inicio + n]
+        self.posición = inicio + len(trozo)
+        return bytes(trozo)
+
+    def read_u8(self):
+        i = self.datos[self.posición]
+        self.posición += 1
+        return i
+
+    def read_u16(self):
+        i, = U16.unpack_from(self.datos, self.posición)
+        self.posición += 2
+        return i
+
+    def read_u32(self):
+        i, = U32.unpack_from(self.datos, self.posición)
+        self.posición += 4
+        return i
+
+    def read_u64(self):
+        i, = U64.unpack_from(self.datos, self.posición)
+        self.posición += 8
+        return i
+
+    def read_hash(self):
+        '''Lee 32 bytes little endian y los devuelve dados la vuelta'''
+        inicio = self.posición
+        h = bytes(self.datos[inicio:inicio + 32])
+        if len(h) != 32:
+            raise ValueError('faltan bytes para un hash')
+        self.posición = inicio + 32
+        return h[::-1]
+
+    def read_varint(self):
+        i = self.datos[self.posición]
+        self.posición += 1
+        if i < 0xfd:
+            return i
+        elif i == 0xfd:
+            return self.read_u16()
+        elif i == 0xfe:
+            return self.read_u32()
+        else:
+            return self.read_u64()
+
+
+class LectorStream:
+    '''Da la interfaz de LectorBytes a un stream con read(n), como un socket'''
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, n):
+        return self.stream.read(n)
+
+    def read_vista(self, n):
+        return memoryview(self.stream.read(n))
+
+    def read_u8(self):
+        return self.stream.read(1)[0]
+
+    def read_u16(self):
+        return U16.unpack(self.stream.read(2))[0]
+
+    def read_u32(self):
+        return U32.unpack(self.stream.read(4))[0]
+
+    def read_u64(self):
+        return U64.unpack(self.stream.read(8))[0]
+
+    def read_hash(self):
+        h = self.stream.read(32)
+        if len(h) != 32:
+            raise ValueError('faltan bytes para un hash')
+        return h[::-1]
+
+    def read_varint(self):
+        return read_varint(self.stream)
+
+
+def a_lector(s):
+    '''Devuelve un lector para s: bytes, memoryview, un lector o cualquier stream'''
+    if type(s) is LectorBytes or type(s) is LectorStream:
+        return s
+    if isinstance(s, (bytes, bytearray, memoryview)):
+        return LectorBytes(s)
+    return LectorStream(s)
+
+
+class EscritorBytes:
+    '''Acumula una serialización en un único bytearray. Los objetos anidados
+    escriben con serializar_en en el mismo buffer'''
+
+    __slots__ = ('datos',)
+
+    def __init__(self):
+        self.datos = bytearray()
+
+    def __len__(self):
+        return len(self.datos)
+
+    def getvalue(self):
+        '''Devuelve lo escrito como bytes'''
+        return bytes(self.datos)
+
+    def write(self, b):
+        self.datos += b
+
+    def write_u8(self, i):
+        self.datos.append(i)
+
+    def write_u16_le(self, i):
+        self.datos += U16.pack(i)
+
+    def write_u32_le(self, i):
+        self.datos += U32.pack(i)
+
+    def write_u64_le(self, i):
+        self.datos += U64.pack(i)
+
+    def write_hash(self, h):
+        '''Escribe un hash de 32 bytes en little endian'''
+        self.datos += h[::-1]
+
+    def write_varint(self, i):
+        if i < 0xfd:
+            self.datos.append(i)
+        else:
+            self.datos += codificar_varint(i)
+
+
 def codificar_varint(i):
     '''codifica un entero como un varint'''
     if i < 0xfd:
@@ -146,15 +561,15 @@ def padre_merkle(hash1, hash2):
 
 
 def nivel_padre_merkle(hashes):
-    '''Toma una lista de hashes binarios yd evuelve una lista que tiene la mitad
-    de longitud'''
+    '''Toma una lista de hashes binarios y devuelve una lista que tiene la mitad
+    de longitud. No modifica la lista original'''
     # Ejercicio 2.2: si la lista tiene exactamente 1 elemento debe dar error
     if len(hashes) == 1:
         raise RuntimeError('No puede tomar un nivel padre con un solo elemento')
     # Ejercicio 3.2: si la lista tiene un número impar de elementos, duplica el último
-    #               y ponlo al final para que tengan un número par de elementos
+    #               en una lista nueva para que tengan un número par de elementos
     if len(hashes) % 2 == 1:
-        hashes.append(hashes[-1])
+        hashes = hashes + [hashes[-1]]
     # Ejercicio 2.2: inicializa el siguiente nivel
     nivel_padre = []
     # Ejercicio 2.2: haz un bucle por cada pareja (usa: for i in range(0, len(hashes), 2))
@@ -167,41 +582,266 @@ def nivel_padre_merkle(hashes):
     return nivel_padre
 
 
+# hojas que se copian de una vez al buffer de raíz_merkle
+TROZO_HOJAS_MERKLE = 4096
+
+
+def nivel_padre_merkle_bytes(nivel):
+    '''Toma un nivel como bytes contiguos (32 bytes por hash) y devuelve el
+    nivel padre en un único bytearray. No modifica nivel'''
+    sha256 = hashlib.sha256
+    # el nivel padre se reserva de una vez: la mitad de hashes, redondeando arriba
+    padres = bytearray(32 * ((len(nivel) // 32 + 1) // 2))
+    fin = len(nivel) - len(nivel) % 64
+    with memoryview(nivel) as vista:
+        # cada pareja son 64 bytes seguidos: se hashean sin copiarlos
+        j = 0
+        for i in range(0, fin, 64):
+            padres[j:j + 32] = sha256(sha256(vista[i:i + 64]).digest()).digest()
+            j += 32
+        if fin != len(nivel):
+            # el último hash no tiene pareja: se combina consigo mismo
+            último = bytes(vista[fin:])
+            padres[j:j + 32] = sha256(sha256(último + último).digest()).digest()
+    return padres
+
+
+def hashes_a_nivel(hashes):
+    '''Copia la lista de hashes de 32 bytes a un único bytearray contiguo'''
+    # se reserva de una vez y se copia por trozos: join de millones de
+    # elementos reserva una estructura auxiliar por elemento
+    nivel = bytearray(32 * len(hashes))
+    for i in range(0, len(hashes), TROZO_HOJAS_MERKLE):
+        trozo = b''.join(hashes[i:i + TROZO_HOJAS_MERKLE])
+        if len(trozo) != 32 * len(hashes[i:i + TROZO_HOJAS_MERKLE]):
+            raise ValueError('los hashes deben tener 32 bytes')
+        nivel[32 * i:32 * i + len(trozo)] = trozo
+    return nivel
+
+
 def raíz_merkle(hashes):
     '''Toma una lista de hashes binarios y devuelve la raíz merkle
     '''
-    # el nivel actual empieza como hashes
-    nivel_actual = hashes
-    # haz un bucle hasta que haya exactamente 1 elemento
-    while len(nivel_actual) > 1:
-        # el nivel actual se convierte en el nivel de padre merkle
-        nivel_actual = nivel_padre_merkle(nivel_actual)
-    # devuelve el primer elemento de nivel_actual
-    return nivel_actual[0]
+    if not hashes:
+        raise RuntimeError('No hay raíz merkle de una lista vacía')
+    # el nivel actual empieza como los hashes seguidos en un solo buffer
+    nivel_actual = hashes_a_nivel(hashes)
+    # haz un bucle hasta que haya exactamente 1 hash
+    while len(nivel_actual) > 32:
+        # el nivel actual se convierte en el nivel padre
+        nivel_actual = nivel_padre_merkle_bytes(nivel_actual)
+    return bytes(nivel_actual)
+
+
+class ÁrbolMerkleCompleto:
+    '''Árbol merkle que conserva todos sus nodos. Cada nivel es un bytearray
+    contiguo con 32 bytes por hash; el nivel 0 son las hojas'''
+
+    def __init__(self, hashes):
+        if not hashes:
+            raise RuntimeError('No hay árbol merkle de una lista vacía')
+        self.niveles = [hashes_a_nivel(hashes)]
+        while len(self.niveles[-1]) > 32:
+            self.niveles.append(nivel_padre_merkle_bytes(self.niveles[-1]))
+
+    def __len__(self):
+        return len(self.niveles[0]) // 32
+
+    def hash(self, nivel, índice):
+        '''Devuelve el hash en la posición índice del nivel'''
+        return bytes(self.niveles[nivel][32 * índice:32 * índice + 32])
+
+    def raíz(self):
+        return bytes(self.niveles[-1])
+
+    def prueba_inclusión(self, índice):
+        '''Devuelve los hashes hermanos desde la hoja índice hasta la raíz'''
+        if not 0 <= índice < len(self):
+            raise IndexError('no hay hoja {}'.format(índice))
+        prueba = []
+        for nivel in self.niveles[:-1]:
+            hermano = índice ^ 1
+            # el último de un nivel impar no tiene hermano: se combina consigo mismo
+            if 32 * hermano >= len(nivel):
+                hermano = índice
+            prueba.append(bytes(nivel[32 * hermano:32 * hermano + 32]))
+            índice //= 2
+        return prueba
+
+    def actualizar(self, índice, h):
+        '''Cambia la hoja índice por h y recalcula solo su camino hasta la raíz'''
+        if not 0 <= índice < len(self):
+            raise IndexError('no hay hoja {}'.format(índice))
+        if len(h) != 32:
+            raise ValueError('los hashes deben tener 32 bytes')
+        self.niveles[0][32 * índice:32 * índice + 32] = h
+        for nivel, padres in zip(self.niveles, self.niveles[1:]):
+            # la pareja del nodo empieza en el índice par
+            izquierda = índice - índice % 2
+            pareja = bytes(nivel[32 * izquierda:32 * izquierda + 64])
+            if len(pareja) == 32:
+                pareja = pareja + pareja
+            índice //= 2
+            padres[32 * índice:32 * índice + 32] = doble_sha256(pareja)
+
+
+def verificar_inclusión(h, índice, prueba, raíz):
+    '''Comprueba que el hash h es la hoja índice del árbol con esa raíz'''
+    for hermano in prueba:
+        if índice % 2 == 0:
+            h = padre_merkle(h, hermano)
+        else:
+            h = padre_merkle(hermano, h)
+        índice //= 2
+    return h == raíz
+
+
+class AcumuladorMerkle:
+    '''Calcula la raíz merkle recibiendo los hashes de uno en uno.
+    Solo guarda un subárbol completo pendiente por nivel: O(log n) hashes'''
+
+    def __init__(self):
+        self.cantidad = 0
+        # pendientes[k] es la raíz de un subárbol completo de 2**k hojas
+        # (solo tiene sentido si el bit k de cantidad está a 1)
+        self.pendientes = []
+
+    def __len__(self):
+        return self.cantidad
+
+    def añadir(self, h):
+        '''Añade el siguiente hash hoja'''
+        nivel = 0
+        # cada bit a 1 de cantidad es un subárbol con el que hay que combinarse
+        while self.cantidad >> nivel & 1:
+            h = padre_merkle(self.pendientes[nivel], h)
+            nivel += 1
+        if nivel == len(self.pendientes):
+            self.pendientes.append(h)
+        else:
+            self.pendientes[nivel] = h
+        self.cantidad += 1
+
+    def raíz(self):
+        '''Devuelve la raíz merkle de los hashes añadidos hasta ahora,
+        la misma que raíz_merkle. Se pueden seguir añadiendo después'''
+        if self.cantidad == 0:
+            raise RuntimeError('No hay raíz merkle de una lista vacía')
+        cantidad = self.cantidad
+        # empieza por el subárbol pendiente más pequeño
+        nivel = 0
+        while not cantidad >> nivel & 1:
+            nivel += 1
+        h = self.pendientes[nivel]
+        # mientras no quede un único subárbol completo
+        while cantidad != 1 << nivel:
+            # h está solo en su nivel: se combina consigo mismo, como si se
+            # duplicara el último hash del nivel
+            h = padre_merkle(h, h)
+            cantidad += 1 << nivel
+            nivel += 1
+            # y sube combinándose con los subárboles pendientes de su izquierda
+            while not cantidad >> nivel & 1:
+                h = padre_merkle(self.pendientes[nivel], h)
+                nivel += 1
+        return h
 
 
 def campo_bit_a_bytes(campo_bit):
     if len(campo_bit) % 8 != 0:
         raise RuntimeError('campo_bit no tiene una longitud divisible entre 8')
-    res = bytearray(len(campo_bit) // 8)
-    for i, bit in enumerate(campo_bit):
-        byte_index, bit_index = divmod(i, 8)
-        if bit:
-            res[byte_index] |= 1 << bit_index
-    return bytes(res)
+    if len(campo_bit) == 0:
+        return b''
+    # el bit i es el bit i del entero: se escriben de derecha a izquierda
+    num = int(''.join('1' if bit else '0' for bit in reversed(campo_bit)), 2)
+    # y en little endian el bit i cae en el byte i // 8, posición i % 8
+    return num.to_bytes(len(campo_bit) // 8, 'little')
 
 
 def bytes_a_campo_bit(algunos_bytes):
-    flag_bits = []
-    # itera sobre cada byte de flags
-    for byte in algunos_bytes:
-        # itera sobre cada bit, derecha a izquierda
-        for _ in range(8):
-            # añade el bit actual (byte & 1)
-            flag_bits.append(byte & 1)
-            # mueve a la derecha el byte 1
-            byte >>= 1
-    return flag_bits
+    # el bit i del entero little endian es el bit i % 8 del byte i // 8
+    num = int.from_bytes(algunos_bytes, 'little')
+    # bin da los bits de izquierda a derecha: se les da la vuelta
+    bits = format(num, '0{}b'.format(len(algunos_bytes) * 8))[::-1]
+    return [1 if c == '1' else 0 for c in bits]
+
+
+class CampoBits:
+    '''Campo de bits compacto sobre un bytearray, un bit por bit. El bit i es
+    el bit i % 8 del byte i // 8, como en campo_bit_a_bytes'''
+
+    __slots__ = ('datos', 'longitud')
+
+    def __init__(self, longitud, datos=None):
+        if datos is None:
+            datos = bytearray((longitud + 7) // 8)
+        elif len(datos) * 8 < longitud:
+            raise ValueError('faltan bytes para {} bits'.format(longitud))
+        self.datos = bytearray(datos)
+        self.longitud = longitud
+
+    @classmethod
+    def desde_bytes(cls, algunos_bytes):
+        return cls(len(algunos_bytes) * 8, algunos_bytes)
+
+    @classmethod
+    def desde_lista(cls, campo_bit):
+        longitud = len(campo_bit)
+        # rellena hasta un múltiplo de 8 para convertir con campo_bit_a_bytes
+        relleno = list(campo_bit) + [0] * (-longitud % 8)
+        return cls(longitud, campo_bit_a_bytes(relleno))
+
+    def __len__(self):
+        return self.longitud
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.longitud:
+            raise IndexError('bit fuera del campo: {}'.format(i))
+        return self.datos[i >> 3] >> (i & 7) & 1
+
+    def __setitem__(self, i, bit):
+        if not 0 <= i < self.longitud:
+            raise IndexError('bit fuera del campo: {}'.format(i))
+        if bit:
+            self.datos[i >> 3] |= 1 << (i & 7)
+        else:
+            self.datos[i >> 3] &= ~(1 << (i & 7)) & 0xff
+
+    def __iter__(self):
+        return iter(self.a_lista())
+
+    def __eq__(self, otro):
+        return self.longitud == otro.longitud and self.datos == otro.datos
+
+    def a_bytes(self):
+        return bytes(self.datos)
+
+    def a_lista(self):
+        return bytes_a_campo_bit(self.datos)[:self.longitud]
+
+    def cursor(self):
+        return CursorBits(self)
+
+
+class CursorBits:
+    '''Recorre un campo de bits (o una lista de bits) en orden sin modificarlo'''
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.posición = 0
+
+    def siguiente(self):
+        '''Devuelve el siguiente bit y avanza'''
+        bit = self.bits[self.posición]
+        self.posición += 1
+        return bit
+
+    def restantes(self):
+        return len(self.bits) - self.posición
+
+    def resto_a_cero(self):
+        '''Devuelve si todos los bits que quedan por leer son 0'''
+        return not any(self.bits[i] for i in range(self.posición, len(self.bits)))
 
 
 def murmur3(datos, semilla=0):
@@ -247,6 +887,82 @@ def murmur3(datos, semilla=0):
     return h1 & 0xffffffff
 
 
+# con numpy se hashean a la vez muchas semillas o muchos elementos
+USAR_NUMPY = numpy is not None
+# por debajo de este número de hashes numpy cuesta más de lo que ahorra
+MÍNIMO_LOTE_NUMPY = 16
+
+
+def murmur3_numpy(bloques, cola, longitud, h1):
+    '''murmur3 vectorizado. bloques es un array (n, b) de uint32 con los bloques
+    de 4 bytes, cola un array (n,) con los bytes sobrantes como entero little
+    endian, longitud la de los datos y h1 un array (n,) con las semillas'''
+    c1 = numpy.uint32(0xcc9e2d51)
+    c2 = numpy.uint32(0x1b873593)
+    h1 = numpy.array(h1, dtype=numpy.uint32)
+    # las operaciones con uint32 ya se quedan en 32 bits
+    for j in range(bloques.shape[1]):
+        k1 = bloques[:, j] * c1
+        k1 = (k1 << 15) | (k1 >> 17)  # ROTL32(k1,15)
+        k1 *= c2
+        h1 ^= k1
+        h1 = (h1 << 13) | (h1 >> 19)  # ROTL32(h1,13)
+        h1 = h1 * numpy.uint32(5) + numpy.uint32(0xe6546b64)
+    if longitud & 3:
+        k1 = cola * c1
+        k1 = (k1 << 15) | (k1 >> 17)  # ROTL32(k1,15)
+        k1 *= c2
+        h1 ^= k1
+    # finalización
+    h1 ^= numpy.uint32(longitud & 0xffffffff)
+    # fmix(h1)
+    h1 ^= h1 >> 16
+    h1 *= numpy.uint32(0x85ebca6b)
+    h1 ^= h1 >> 13
+    h1 *= numpy.uint32(0xc2b2ae35)
+    h1 ^= h1 >> 16
+    return h1
+
+
+def bloques_murmur3(filas):
+    '''Separa un array (n, longitud) de uint8 en los bloques y la cola de murmur3'''
+    fin = filas.shape[1] & ~3
+    bloques = numpy.ascontiguousarray(filas[:, :fin]).view('<u4').astype(numpy.uint32)
+    cola = numpy.zeros(filas.shape[0], dtype=numpy.uint32)
+    for i in range(filas.shape[1] - fin):
+        cola |= filas[:, fin + i].astype(numpy.uint32) << numpy.uint32(8 * i)
+    return bloques, cola
+
+
+def murmur3_semillas(datos, semillas):
+    '''Devuelve la lista de murmur3(datos, semilla) para cada semilla'''
+    if not USAR_NUMPY or len(semillas) < MÍNIMO_LOTE_NUMPY:
+        return [murmur3(datos, semilla) for semilla in semillas]
+    filas = numpy.frombuffer(bytes(datos), dtype=numpy.uint8).reshape(1, len(datos))
+    bloques, cola = bloques_murmur3(filas)
+    # solo cuentan los 32 bits bajos de la semilla
+    h1 = [semilla & 0xffffffff for semilla in semillas]
+    return murmur3_numpy(bloques, cola, len(datos), h1).tolist()
+
+
+def murmur3_lote(elementos, semilla=0):
+    '''Devuelve la lista de murmur3(elemento, semilla) para cada elemento'''
+    if not USAR_NUMPY or len(elementos) < MÍNIMO_LOTE_NUMPY:
+        return [murmur3(elemento, semilla) for elemento in elementos]
+    # se vectoriza por grupos de elementos de la misma longitud
+    por_longitud = {}
+    for índice, elemento in enumerate(elementos):
+        por_longitud.setdefault(len(elemento), []).append(índice)
+    res = [0] * len(elementos)
+    for longitud, índices in por_longitud.items():
+        filas = numpy.frombuffer(b''.join(bytes(elementos[i]) for i in índices), dtype=numpy.uint8)
+        bloques, cola = bloques_murmur3(filas.reshape(len(índices), longitud))
+        h1 = numpy.full(len(índices), semilla & 0xffffffff, dtype=numpy.uint32)
+        for índice, h in zip(índices, murmur3_numpy(bloques, cola, longitud, h1).tolist()):
+            res[índice] = h
+    return res
+
+
 class PruebaAyudante(TestCase):
 
     def prueba_bytes(self):
@@ -278,6 +994,63 @@ class PruebaAyudante(TestCase):
         self.assertEqual(h160, want)
         got = codificar_base58_checksum(b'\x6f' + bytes.fromhex(h160))
         self.assertEqual(got, dire)
+        # WIF comprimido del secreto 1: 38 bytes, no 25
+        wif = 'KwDiBf89QgGbjEhKnhXJuH7LrciVrZi3qYjgd9M7rFU73sVHnoWn'
+        bruto = b'\x80' + (1).to_bytes(32, 'big') + b'\x01'
+        self.assertEqual(codificar_base58_checksum(bruto), wif)
+        self.assertEqual(decodificar_base58_checksum(wif), bruto)
+        for bruto in (b'', b'\x00', b'\x00\x00\x01', b'\xff' * 50, b'\x00' + bytes(range(1, 40))):
+            codificado = codificar_base58(bruto).decode('ascii')
+            self.assertEqual(decodificar_base58_bruto(codificado), bruto)
+        with self.assertRaises(ValueError):
+            decodificar_base58_bruto('mnrVtF8DWjMu839VW3rBfgYaAfKk8983X0')
+        with self.assertRaises(RuntimeError):
+            decodificar_base58('mnrVtF8DWjMu839VW3rBfgYaAfKk8983Xg')
+
+    def prueba_base58_lote(self):
+        h160s = [bytes.fromhex('507b27411ccf7f16f10297de6cef3f291623eddf'),
+                 bytes.fromhex('74d691da1574e6b3c192ecfb52cc8984ee7b6c56')]
+        dires = codificar_base58_lote([b'\x6f' + h160s[0], b'\x00' + h160s[1]])
+        self.assertEqual(dires, ['mnrVtF8DWjMu839VW3rBfgYaAfKk8983Xf', '1BenRpVUFK65JFWcQSuHnJKzc4M8ZP8Eqa'])
+        self.assertEqual(decodificar_base58_lote(dires), h160s)
+
+    def prueba_lector_bytes(self):
+        datos = bytes.fromhex('01000000fd0302fe0f0000000102030405060708') + bytes(range(32)) + b'fin'
+        for lector in (a_lector(datos), a_lector(BytesIO(datos))):
+            self.assertEqual(lector.read_u32(), 1)
+            self.assertEqual(lector.read_varint(), 0x0203)
+            self.assertEqual(lector.read_varint(), 0x0f)
+            self.assertEqual(lector.read_u64(), 0x0807060504030201)
+            self.assertEqual(lector.read_hash(), bytes(range(32))[::-1])
+            self.assertEqual(read_varint(lector), ord('f'))
+            self.assertEqual(lector.read(5), b'in')
+        lector = LectorBytes(datos, 4)
+        self.assertIs(a_lector(lector), lector)
+        vista = lector.read_vista(3)
+        self.assertIsInstance(vista, memoryview)
+        self.assertEqual(vista, b'\xfd\x03\x02')
+        self.assertEqual(lector.restantes(), len(datos) - 7)
+        # un bytearray se copia: se puede seguir cambiando sin afectar al lector
+        buffer = bytearray(datos)
+        lector = LectorBytes(buffer)
+        vista = lector.read_vista(4)
+        buffer += b'x'
+        buffer[0] = 0xff
+        self.assertEqual(vista, b'\x01\x00\x00\x00')
+
+    def prueba_escritor_bytes(self):
+        escritor = EscritorBytes()
+        escritor.write_u32_le(1)
+        escritor.write_varint(0x0203)
+        escritor.write_varint(0x0f)
+        escritor.write_u64_le(0x0807060504030201)
+        escritor.write_hash(bytes(range(32))[::-1])
+        escritor.write_u16_le(0xfffe)
+        escritor.write_u8(0x66)
+        escritor.write(b'in')
+        want = bytes.fromhex('01000000fd0302' + '0f0102030405060708') + bytes(range(32)) + b'\xfe\xff' + b'fin'
+        self.assertEqual(escritor.getvalue(), want)
+        self.assertEqual(len(escritor), len(want))
 
     def prueba_dire_p2pkh(self):
         h160 = bytes.fromhex('74d691da1574e6b3c192ecfb52cc8984ee7b6c56')
@@ -345,6 +1118,134 @@ class PruebaAyudante(TestCase):
         want_hash = bytes.fromhex(want_hex_hash)
         self.assertEqual(raíz_merkle(tx_hashes), want_hash)
 
+    def prueba_raíz_merkle_sin_mutar(self):
+        for cantidad in (1, 2, 3, 5, 8, 13):
+            tx_hashes = [doble_sha256(bytes([i])) for i in range(cantidad)]
+            copia = list(tx_hashes)
+            # la referencia: nivel a nivel con listas
+            nivel = tx_hashes
+            while len(nivel) > 1:
+                nivel = nivel_padre_merkle(nivel)
+            self.assertEqual(raíz_merkle(tx_hashes), nivel[0])
+            self.assertEqual(tx_hashes, copia)
+
+    def prueba_acumulador_merkle(self):
+        acumulador = AcumuladorMerkle()
+        tx_hashes = []
+        for i in range(70):
+            h = doble_sha256(bytes([i]))
+            tx_hashes.append(h)
+            acumulador.añadir(h)
+            self.assertEqual(acumulador.raíz(), raíz_merkle(tx_hashes))
+            # log2(i + 1) subárboles pendientes como mucho
+            self.assertLessEqual(len(acumulador.pendientes), (i + 1).bit_length())
+        self.assertEqual(len(acumulador), 70)
+
+    def prueba_árbol_merkle_completo(self):
+        for cantidad in (1, 2, 5, 12):
+            tx_hashes = [doble_sha256(bytes([i])) for i in range(cantidad)]
+            árbol = ÁrbolMerkleCompleto(tx_hashes)
+            self.assertEqual(len(árbol), cantidad)
+            self.assertEqual(árbol.raíz(), raíz_merkle(tx_hashes))
+            for índice, h in enumerate(tx_hashes):
+                prueba = árbol.prueba_inclusión(índice)
+                self.assertEqual(len(prueba), len(árbol.niveles) - 1)
+                self.assertTrue(verificar_inclusión(h, índice, prueba, árbol.raíz()))
+                self.assertFalse(verificar_inclusión(doble_sha256(b'otra'), índice, prueba, árbol.raíz()))
+            # cambiar una hoja recalcula su camino
+            tx_hashes[cantidad - 1] = doble_sha256(b'nueva')
+            árbol.actualizar(cantidad - 1, tx_hashes[cantidad - 1])
+            self.assertEqual(árbol.raíz(), raíz_merkle(tx_hashes))
+            self.assertEqual(árbol.hash(0, cantidad - 1), tx_hashes[cantidad - 1])
+        with self.assertRaises(IndexError):
+            árbol.prueba_inclusión(cantidad)
+
+    def prueba_ripemd160(self):
+        vectores = (
+            (b'', '9c1185a5c5e9fc54612808977ee8f548b2258d31'),
+            (b'abc', '8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'),
+            (b'abcdefghijklmnopqrstuvwxyz', 'f71c27109c692c1b56bbdceb5b9d2865b3708dbc'),
+            (b'1234567890' * 8, '9b752e45573d4b39f4dbd3323cab82bf63326bfb'),
+        )
+        for entrada, esperado in vectores:
+            self.assertEqual(ripemd160_python(entrada).hex(), esperado)
+        # longitudes alrededor del límite de bloque y de las claves públicas
+        for longitud in (20, 32, 33, 55, 56, 63, 64, 65, 130):
+            entrada = bytes(range(longitud % 256)) * (longitud // 256 + 1)
+            self.assertEqual(ripemd160_python(entrada[:longitud]), ripemd160(entrada[:longitud]))
+
+    def prueba_elegir_ripemd160(self):
+        def sin_openssl(s):
+            raise ValueError('unsupported hash type ripemd160')
+
+        def incorrecta(s):
+            return bytes(20)
+
+        self.assertIs(elegir_ripemd160((sin_openssl, incorrecta, ripemd160_python)), ripemd160_python)
+        with self.assertRaises(RuntimeError):
+            elegir_ripemd160((sin_openssl, incorrecta))
+
+    def prueba_hashear_lote(self):
+        datos = [bytes([i]) * i for i in range(50)] + [b'x' * 3000]
+        esperado_sha = [doble_sha256(s) for s in datos]
+        esperado_160 = [hash160(s) for s in datos]
+        for modo in (None, 'serie', 'hilos', 'procesos'):
+            self.assertEqual(doble_sha256_lote(iter(datos), modo, 2), esperado_sha)
+            self.assertEqual(hash160_lote(datos, modo, 2), esperado_160)
+        self.assertEqual(hashear_lote(doble_sha256_trozo, datos, 'hilos', 2, tamaño_trozo=7), esperado_sha)
+        # con entradas pequeñas el modo automático no usa procesos: una lambda
+        # no se puede enviar a otro proceso
+        self.assertEqual(hashear_lote(lambda trozo: [doble_sha256(s) for s in trozo],
+                                      datos[:50], None, 2, mínimo_paralelo=1), esperado_sha[:50])
+        with self.assertRaises(ValueError):
+            doble_sha256_lote(datos, 'gpu')
+
+    def prueba_campo_bits(self):
+        campo_bit = [0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0]
+        campo = CampoBits.desde_bytes(bytes.fromhex('4000600a080000010940'))
+        self.assertEqual(len(campo), 80)
+        self.assertEqual(campo.a_lista(), campo_bit)
+        self.assertEqual([campo[i] for i in range(80)], campo_bit)
+        self.assertEqual(CampoBits.desde_lista(campo_bit), campo)
+        campo[0] = 1
+        campo[6] = 0
+        self.assertEqual(campo.a_bytes().hex(), '0100600a080000010940')
+        with self.assertRaises(IndexError):
+            campo[80]
+        # la longitud no tiene por qué ser múltiplo de 8
+        corto = CampoBits.desde_lista([1, 0, 1])
+        self.assertEqual(list(corto), [1, 0, 1])
+        self.assertEqual(corto.a_bytes(), b'\x05')
+        cursor = corto.cursor()
+        self.assertEqual(cursor.siguiente(), 1)
+        self.assertFalse(cursor.resto_a_cero())
+        self.assertEqual(cursor.siguiente(), 0)
+        self.assertEqual(cursor.siguiente(), 1)
+        self.assertTrue(cursor.resto_a_cero())
+        self.assertEqual(cursor.restantes(), 0)
+        self.assertEqual(campo_bit_a_bytes([]), b'')
+
+    def prueba_murmur3(self):
+        self.assertEqual(murmur3(b'hello'), 0x248bfa47)
+        self.assertEqual(murmur3(b'', 1), 0x514e28b7)
+
+    def prueba_murmur3_vectorizado(self):
+        global USAR_NUMPY
+        elementos = [bytes(range(longitud)) + bytes([i]) for i in range(3) for longitud in range(40)]
+        semillas = [i * 0xfba4c795 + 99 for i in range(20)]
+        esperado_semillas = [murmur3(elementos[-1], semilla) for semilla in semillas]
+        esperado_lote = [murmur3(elemento, 12345) for elemento in elementos]
+        original = USAR_NUMPY
+        try:
+            # el camino de numpy (si está instalado) y el de Python puro
+            for usar_numpy in {original, False}:
+                USAR_NUMPY = usar_numpy
+                self.assertEqual(murmur3_semillas(elementos[-1], semillas), esperado_semillas)
+                self.assertEqual(murmur3_lote(elementos, 12345), esperado_lote)
+                self.assertEqual(murmur3_lote([], 1), [])
+        finally:
+            USAR_NUMPY = original
+
     def prueba_campo_bit_a_bytes(self):
         campo_bit = [0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0]
         want = '4000600a080000010940'
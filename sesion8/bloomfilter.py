@@ -1,6 +1,12 @@
 from unittest import TestCase
 
-from ayudante import campo_bit_a_bytes, codificar_varint, int_a_little_endian, murmur3
+from ayudante import (
+    CampoBits,
+    codificar_varint,
+    int_a_little_endian,
+    murmur3_lote,
+    murmur3_semillas,
+)
 
 
 CONSTANTE_BIP37 = 0xfba4c795
@@ -10,30 +16,43 @@ class BloomFilter:
 
     def __init__(self, tamaño, función_contador, tweak):
         self.tamaño = tamaño
-        self.bit_field = [0] * (tamaño * 8)
+        self.bit_field = CampoBits(tamaño * 8)
         self.función_contador = función_contador
         self.tweak = tweak
 
+    def semillas(self):
+        '''Las semillas de BIP0037: i*CONSTANTE_BIP37 + self.tweak'''
+        return [i * CONSTANTE_BIP37 + self.tweak for i in range(self.función_contador)]
+
     def add(self, cosa):
         '''Añade una cosa al filtro'''
-        # iterate self.función_contador number of times
-            # BIP0037 spec seed is i*CONSTANTE_BIP37 + self.tweak
-            # get the murmur3 hash given that seed
-            # set the bit at the hash mod the bitfield tamaño (self.tamaño*8)
-            # set the bit field at bit to be 1
-        raise NotImplementedError
+        # un murmur3 por cada semilla, todos de una vez
+        for h in murmur3_semillas(cosa, self.semillas()):
+            # pon a 1 el bit del hash módulo el tamaño del campo de bits (self.tamaño*8)
+            self.bit_field[h % (self.tamaño * 8)] = 1
+
+    def add_lote(self, cosas):
+        '''Añade muchas cosas al filtro hasheándolas juntas para cada semilla'''
+        for semilla in self.semillas():
+            for h in murmur3_lote(cosas, semilla):
+                self.bit_field[h % (self.tamaño * 8)] = 1
 
     def filtro_bytes(self):
-        return campo_bit_a_bytes(self.bit_field)
+        return self.bit_field.a_bytes()
 
     def filterload(self, flag=1):
         '''Return the payload that goes in a filterload message'''
         # start with the tamaño of the filter in bytes
+        carga = codificar_varint(self.tamaño)
         # next cast the filter to bytes
+        carga += self.filtro_bytes()
         # function count is 4 bytes little endian
+        carga += int_a_little_endian(self.función_contador, 4)
         # tweak is 4 bytes little endian
+        carga += int_a_little_endian(self.tweak, 4)
         # flag is 1 byte little endian
-        raise NotImplementedError
+        carga += int_a_little_endian(flag, 1)
+        return carga
 
 
 class BloomFilterTest(TestCase):
@@ -49,6 +68,15 @@ class BloomFilterTest(TestCase):
         esperado = '4000600a080000010940'
         self.assertEqual(bf.filtro_bytes().hex(), esperado)
 
+    def prueba_sumar_lote(self):
+        cosas = [b'Hello World', b'Goodbye!'] + [bytes([i]) * i for i in range(40)]
+        bf = BloomFilter(10, 5, 99)
+        for cosa in cosas:
+            bf.add(cosa)
+        bf_lote = BloomFilter(10, 5, 99)
+        bf_lote.add_lote(cosas)
+        self.assertEqual(bf_lote.filtro_bytes(), bf.filtro_bytes())
+
     def prueba_filtrocarga(self):
         bf = BloomFilter(10, 5, 99)
         cosa = b'Hello World'
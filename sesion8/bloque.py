@@ -2,8 +2,9 @@ from io import BytesIO
 from unittest import TestCase
 
 from ayudante import (
+    a_lector,
     doble_sha256,
-    int_a_little_endian,
+    EscritorBytes,
     little_endian_a_int,
     raíz_merkle,
 )
@@ -28,15 +29,16 @@ class Bloque:
     @classmethod
     def parsear(cls, s):
         '''Toma un stream de bytes y parsea un bloque. Devuelve un objeto Bloque'''
-        # s.read(n) leerá n bytes desde el stream
+        # s puede ser bytes, un LectorBytes o cualquier stream
+        s = a_lector(s)
         # versión - 4 bytes, little endian, interpretalo como int
-        versión = little_endian_a_int(s.read(4))
-        # bloque_previo - 32 bytes, little endian (usa [::-1] para darle la vuelta)
-        bloque_previo = s.read(32)[::-1]
-        # raíz_merkle - 32 bytes, little endian (usa [::-1] para darle la vuelta)
-        raíz_merkle = s.read(32)[::-1]
+        versión = s.read_u32()
+        # bloque_previo - 32 bytes, little endian (read_hash le da la vuelta)
+        bloque_previo = s.read_hash()
+        # raíz_merkle - 32 bytes, little endian (read_hash le da la vuelta)
+        raíz_merkle = s.read_hash()
         # timestamp - 4 bytes, little endian, interpretalo como int
-        timestamp = little_endian_a_int(s.read(4))
+        timestamp = s.read_u32()
         # bits - 4 bytes
         bits = s.read(4)
         # nonce - 4 bytes
@@ -46,19 +48,24 @@ class Bloque:
 
     def serializar(self):
         '''Devuelve la cabecera del bloque de 80 bytes'''
+        escritor = EscritorBytes()
+        self.serializar_en(escritor)
+        return escritor.getvalue()
+
+    def serializar_en(self, escritor):
+        '''Escribe la cabecera del bloque en el EscritorBytes'''
         # versión - 4 bytes, little endian
-        res = int_a_little_endian(self.versión, 4)
+        escritor.write_u32_le(self.versión)
         # bloque_previo - 32 bytes, little endian
-        res += self.bloque_previo[::-1]
+        escritor.write_hash(self.bloque_previo)
         # raíz_merkle - 32 bytes, little endian
-        res += self.raíz_merkle[::-1]
+        escritor.write_hash(self.raíz_merkle)
         # timestamp - 4 bytes, little endian
-        res += int_a_little_endian(self.timestamp, 4)
+        escritor.write_u32_le(self.timestamp)
         # bits - 4 bytes
-        res += self.bits
+        escritor.write(self.bits)
         # nonce - 4 bytes
-        res += self.nonce
-        return res
+        escritor.write(self.nonce)
 
     def hash(self):
         '''Devuelve el doble-sha256 interpretado little endian del bloque'''
@@ -4,10 +4,11 @@ from io import BytesIO
 from unittest import TestCase
 
 from ayudante import (
-    bytes_a_campo_bit,
+    a_lector,
+    CampoBits,
+    CursorBits,
     little_endian_a_int,
     padre_merkle,
-    read_varint,
 )
 
 
@@ -81,14 +82,20 @@ class ÁrbolMerkle:
         return len(self.nodes[self.profundidad_actual + 1]) > self.índice_actual * 2 + 1
 
     def poblar_árbol(self, flag_bits, hashes):
+        # flag_bits puede ser un CampoBits o una lista: se recorre con un cursor
+        # en vez de quitar el primer elemento (pop(0) copia toda la lista)
+        flags = CursorBits(flag_bits)
+        # los hashes también se recorren por índice
+        siguiente_hash = 0
         # poblar hasta que tengamos la raíz
         while self.raíz() is None:
             # si tenemos una hoja, sabemos el hash de esta posición
             if self.es_hoja():
-                # obtén el siguiente bit desde flag_bits: flag_bits.pop(0)
-                flag_bits.pop(0)
-                # establece el nodo actual en el árbol Merkle hasta el siguiente hash: hashes.pop(0)
-                self.establece_nodo_actual(hashes.pop(0))
+                # obtén el siguiente bit desde flag_bits
+                flags.siguiente()
+                # establece el nodo actual en el árbol Merkle hasta el siguiente hash
+                self.establece_nodo_actual(hashes[siguiente_hash])
+                siguiente_hash += 1
                 # sube un nivel
                 self.subir()
             # else
@@ -99,9 +106,10 @@ class ÁrbolMerkle:
                 # si no tenemos el hash izquierdo
                 if hash_izquierdo is None:
                     # si el siguiente flag bit es 0, el siguiente hash es nuestro nodo actual
-                    if flag_bits.pop(0) == 0:
+                    if flags.siguiente() == 0:
                         # establece el nodo actual para ser el siguiente hash
-                        self.establece_nodo_actual(hashes.pop(0))
+                        self.establece_nodo_actual(hashes[siguiente_hash])
+                        siguiente_hash += 1
                         # sub-árbol no necesita cálculo, sube
                         self.subir()
                     # else
@@ -133,11 +141,10 @@ class ÁrbolMerkle:
                     self.establece_nodo_actual(padre_merkle(hash_izquierdo, hash_izquierdo))
                     # hemos completado este sub-árbol, sube
                     self.subir()
-        if len(hashes) != 0:
-            raise RuntimeError('los hashes no están consumidos {}'.format(len(hashes)))
-        for flag_bit in flag_bits:
-            if flag_bit != 0:
-                raise RuntimeError('no todos los flag bits han sido consumidos')
+        if siguiente_hash != len(hashes):
+            raise RuntimeError('los hashes no están consumidos {}'.format(len(hashes) - siguiente_hash))
+        if not flags.resto_a_cero():
+            raise RuntimeError('no todos los flag bits han sido consumidos')
 
 
 class PruebaÁrbolMerkle(TestCase):
@@ -212,31 +219,32 @@ class BloqueMerkle:
     @classmethod
     def parsear(cls, s):
         '''Toma un stream de bytes y parsea un bloque merkle. Devuelve un objeto Bloque Merkle'''
-        # s.read(n) leerá n bytes desde el stream
+        # s puede ser bytes, un LectorBytes o cualquier stream
+        s = a_lector(s)
         # versión - 4 bytes, little endian, interpretalo como int
-        versión = little_endian_a_int(s.read(4))
-        # bloque_previo - 32 bytes, little endian (usa [::-1] para darle la vuelta)
-        bloque_previo = s.read(32)[::-1]
-        # raíz_merkle - 32 bytes, little endian (usa [::-1] para darle la vuelta)
-        raíz_merkle = s.read(32)[::-1]
+        versión = s.read_u32()
+        # bloque_previo - 32 bytes, little endian (read_hash le da la vuelta)
+        bloque_previo = s.read_hash()
+        # raíz_merkle - 32 bytes, little endian (read_hash le da la vuelta)
+        raíz_merkle = s.read_hash()
         # timestamp - 4 bytes, little endian, interprétalo como int
-        timestamp = little_endian_a_int(s.read(4))
+        timestamp = s.read_u32()
         # bits - 4 bytes
         bits = s.read(4)
         # nonce - 4 bytes
         nonce = s.read(4)
         # el número total de transacciónes (4 bytes, little endian)
-        total = little_endian_a_int(s.read(4))
+        total = s.read_u32()
         # el número de hashes es un varint
-        num_txs = read_varint(s)
+        num_txs = s.read_varint()
         # inicializa el array de hashes
         hashes = []
         # haz un bucle tantas veces como el número de hashes
         for _ in range(num_txs):
             # cada hash es 32 bytes, little endian
-            hashes.append(s.read(32)[::-1])
+            hashes.append(s.read_hash())
         # obtén la longitud del campo de flags como un varint
-        longitud_flags = read_varint(s)
+        longitud_flags = s.read_varint()
         # lee el campo de flags
         flags = s.read(longitud_flags)
         # inicializa la clase
@@ -245,12 +253,16 @@ class BloqueMerkle:
 
     def es_válido(self):
         '''Verifica si la información en el árbol de merkle valida a la raíz merkles'''
-        # convierte el campo de flags a campo de bits usando bytes_a_campo_bit
+        # convierte el campo de flags a un campo de bits compacto
+        flag_bits = CampoBits.desde_bytes(self.flags)
         # dale la vuelta a los hashes para botener la lista de hashes para el cálculo de la raíz merkle
+        hashes = [h[::-1] for h in self.hashes]
         # inicializa el árbol de merkle
+        árbol = ÁrbolMerkle(self.total)
         # puebla el árbol con flag bits y hashes
+        árbol.poblar_árbol(flag_bits, hashes)
         # comprueba si la raíz computada [::-1] es la misma que la raíz de merkle
-        raise NotImplementedError
+        return árbol.raíz()[::-1] == self.raíz_merkle
 
 
 class PruebaBloqueMerkle(TestCase):
@@ -1,3 +1,10 @@
+import hashlib
+import hmac
+import os
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from io import BytesIO
 from random import randint
 from unittest import TestCase
@@ -6,6 +13,7 @@ from ayudante import codificar_base58_checksum, hash160
 
 
 class ElementoCampo:
+    __slots__ = ('num', 'primo')
 
     def __init__(self, num, primo):
         if num >= primo or num < 0:
@@ -27,7 +35,7 @@ class ElementoCampo:
     def __repr__(self):
         return 'ElementoCampo_{}({})'.format(self.primo, self.num)
 
-    def __sumar__(self, otro):
+    def __add__(self, otro):
         if self.primo != otro.primo:
             raise TypeError('No se pueden sumar dos números en campos diferentes')
         # self.num y otro.num son los valores reales
@@ -38,7 +46,7 @@ class ElementoCampo:
         # usa: self.__class__(num, primo)
         return self.__class__(num, primo)
 
-    def __restar__(self, otro):
+    def __sub__(self, otro):
         if self.primo != otro.primo:
             raise TypeError('No se pueden sumar dos números en campos diferentes')
         # self.num y otro.num son los valores reales
@@ -88,6 +96,27 @@ class ElementoCampo:
         return self.__class__(num=num, primo=self.primo)
 
 
+def invertir_lote(números, primo):
+    '''Devuelve los inversos de todos los números módulo primo con una sola
+    exponenciación y 3N multiplicaciones (truco de Montgomery)'''
+    # acumulados[i] es el producto de números[:i]
+    acumulados = []
+    acumulado = 1
+    for n in números:
+        acumulados.append(acumulado)
+        acumulado = acumulado * n % primo
+    if acumulado == 0:
+        raise ZeroDivisionError('no se puede invertir 0 en el campo {}'.format(primo))
+    # 1/(n0*n1*...*nk) usando el teorema pequeño de Fermat
+    inv = pow(acumulado, primo - 2, primo)
+    res = [0] * len(números)
+    # recorremos hacia atrás: inv es siempre 1/(n0*...*ni)
+    for i in range(len(números) - 1, -1, -1):
+        res[i] = inv * acumulados[i] % primo
+        inv = inv * números[i] % primo
+    return res
+
+
 class PruebaElementoCampo(TestCase):
 
     def prueba_ne(self):
@@ -136,6 +165,15 @@ class PruebaElementoCampo(TestCase):
         b = ElementoCampo(11, 31)
         self.assertEqual(a**-4 * b, ElementoCampo(13, 31))
 
+    def prueba_invertir_lote(self):
+        números = [3, 24, 17, 1, 30]
+        inversos = invertir_lote(números, 31)
+        for n, inv in zip(números, inversos):
+            self.assertEqual(ElementoCampo(1, 31) / ElementoCampo(n, 31), ElementoCampo(inv, 31))
+        self.assertEqual(invertir_lote([], 31), [])
+        with self.assertRaises(ZeroDivisionError):
+            invertir_lote([3, 0, 5], 31)
+
 
 class Punto:
 
@@ -169,7 +207,7 @@ class Punto:
         else:
             return 'Punto({},{})_{}'.format(self.x.num, self.y.num, self.x.primo)
 
-    def __sumar__(self, otro):
+    def __add__(self, otro):
         if self.a != otro.a or self.b != otro.b:
             raise TypeError('Los puntos {}, {} no están en la misma curva'.format(self, otro))
         # Caso 0.0: self es el punto en el infinito, devuelve otro
@@ -385,11 +423,146 @@ B = 7
 P = 2**256 - 2**32 - 977
 N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
 
+# Coordenadas jacobianas: (X, Y, Z) representa el punto afín (X/Z**2, Y/Z**3).
+# Trabajamos con enteros y así solo hace falta una inversión al final.
+# Z == 0 representa el punto en el infinito
+INFINITO_JACOBIANO = (1, 1, 0)
+
+
+def doblar_jacobiano(p):
+    '''Devuelve 2*p en coordenadas jacobianas (fórmulas para a=0)'''
+    x1, y1, z1 = p
+    if z1 == 0 or y1 == 0:
+        return INFINITO_JACOBIANO
+    a = x1 * x1 % P
+    b = y1 * y1 % P
+    c = b * b % P
+    # d = 2*((x1+b)**2-a-c)
+    d = 2 * ((x1 + b) * (x1 + b) - a - c) % P
+    e = 3 * a % P
+    x3 = (e * e - 2 * d) % P
+    y3 = (e * (d - x3) - 8 * c) % P
+    z3 = 2 * y1 * z1 % P
+    return (x3, y3, z3)
+
+
+def sumar_jacobiano(p, q):
+    '''Devuelve p+q, ambos en coordenadas jacobianas'''
+    x1, y1, z1 = p
+    x2, y2, z2 = q
+    # Caso 0: alguno es el punto en el infinito
+    if z1 == 0:
+        return q
+    if z2 == 0:
+        return p
+    z1z1 = z1 * z1 % P
+    z2z2 = z2 * z2 % P
+    u1 = x1 * z2z2 % P
+    u2 = x2 * z1z1 % P
+    s1 = y1 * z2 * z2z2 % P
+    s2 = y2 * z1 * z1z1 % P
+    if u1 == u2:
+        # Caso 1: misma x, distinta y, el resultado es el infinito
+        if s1 != s2:
+            return INFINITO_JACOBIANO
+        # Caso 3: es el mismo punto, lo doblamos
+        return doblar_jacobiano(p)
+    # Caso 2: x distintas
+    h = (u2 - u1) % P
+    r = (s2 - s1) % P
+    h2 = h * h % P
+    h3 = h * h2 % P
+    u1h2 = u1 * h2 % P
+    x3 = (r * r - h3 - 2 * u1h2) % P
+    y3 = (r * (u1h2 - x3) - s1 * h3) % P
+    z3 = h * z1 * z2 % P
+    return (x3, y3, z3)
+
+
+def sumar_mixto_jacobiano(p, q):
+    '''Devuelve p+q con p jacobiano y q afín (x, y), ahorrando multiplicaciones'''
+    x1, y1, z1 = p
+    x2, y2 = q
+    if z1 == 0:
+        return (x2, y2, 1)
+    z1z1 = z1 * z1 % P
+    u2 = x2 * z1z1 % P
+    s2 = y2 * z1 * z1z1 % P
+    if u2 == x1:
+        if s2 != y1:
+            return INFINITO_JACOBIANO
+        return doblar_jacobiano(p)
+    h = (u2 - x1) % P
+    r = (s2 - y1) % P
+    h2 = h * h % P
+    h3 = h * h2 % P
+    x1h2 = x1 * h2 % P
+    x3 = (r * r - h3 - 2 * x1h2) % P
+    y3 = (r * (x1h2 - x3) - y1 * h3) % P
+    z3 = z1 * h % P
+    return (x3, y3, z3)
+
+
+def jacobianos_a_afines(puntos):
+    '''Convierte una lista de puntos jacobianos a (x, y) afines con una sola
+    inversión. El punto en el infinito se convierte en None'''
+    zs = [z for _, _, z in puntos if z != 0]
+    inversos = iter(invertir_lote(zs, P))
+    res = []
+    for x, y, z in puntos:
+        if z == 0:
+            res.append(None)
+            continue
+        z_inv = next(inversos)
+        z_inv2 = z_inv * z_inv % P
+        res.append((x * z_inv2 % P, y * z_inv2 * z_inv % P))
+    return res
+
+
+def multiplicar_jacobiano(coef, p):
+    '''Devuelve coef*p en coordenadas jacobianas usando doblar y sumar'''
+    res = INFINITO_JACOBIANO
+    actual = p
+    while coef:
+        # si el bit en esta expansión binaria es 1, añade
+        if coef & 1:
+            res = sumar_jacobiano(res, actual)
+        # dobla el punto
+        actual = doblar_jacobiano(actual)
+        coef >>= 1
+    return res
+
 
 class CampoS256(ElementoCampo):
+    # primo es fijo para toda la clase y las operaciones no vuelven a
+    # comprobar el campo ni el rango: los resultados ya están reducidos
+    __slots__ = ()
+    primo = P
 
     def __init__(self, num, primo=None):
-        super().__init__(num=num, primo=P)
+        if num >= P or num < 0:
+            error = 'El número {} no está en el rango de campo 0 a {}'.format(
+                num, P - 1)
+            raise ValueError(error)
+        self.num = num
+
+    def __add__(self, otro):
+        return campo_s256((self.num + otro.num) % P)
+
+    def __sub__(self, otro):
+        return campo_s256((self.num - otro.num) % P)
+
+    def __mul__(self, otro):
+        return campo_s256(self.num * otro.num % P)
+
+    def __pow__(self, n):
+        return campo_s256(pow(self.num, n % (P - 1), P))
+
+    def __truediv__(self, otro):
+        return campo_s256(self.num * pow(otro.num, P - 2, P) % P)
+
+    def __rmul__(self, coeficiente):
+        return campo_s256(self.num * coeficiente % P)
 
     def hex(self):
         return '{:x}'.format(self.num).zfill(64)
@@ -401,14 +574,31 @@ class CampoS256(ElementoCampo):
         return self**((P + 1) // 4)
 
 
+def campo_s256(num):
+    '''Crea un CampoS256 sin validar: num tiene que estar ya en [0, P)'''
+    elemento = object.__new__(CampoS256)
+    elemento.num = num
+    return elemento
+
+
+A_S256 = CampoS256(A)
+B_S256 = CampoS256(B)
+
+
 class PuntoS256(Punto):
 
     def __init__(self, x, y, a=None, b=None):
-        a, b = CampoS256(A), CampoS256(B)
         if type(x) == int:
-            super().__init__(x=CampoS256(x), y=CampoS256(y), a=a, b=b)
-        else:
-            super().__init__(x=x, y=y, a=a, b=b)
+            x, y = CampoS256(x), CampoS256(y)
+        self.a = A_S256
+        self.b = B_S256
+        self.x = x
+        self.y = y
+        if x is None and y is None:
+            return
+        # y**2 == x**3 + 7 directamente con enteros
+        if (y.num * y.num - x.num * x.num * x.num - B) % P:
+            raise ValueError('({}, {}) no está en la curva'.format(x, y))
 
     def __repr__(self):
         if self.x is None:
@@ -419,7 +609,30 @@ class PuntoS256(Punto):
     def __rmul__(self, coeficiente):
         # haremos el módulo por N para hacer esto más sencillo
         coef = coeficiente % N
-        return super().__rmul__(coef)
+        # el generador tiene su tabla precalculada
+        if self.x == G.x and self.y == G.y:
+            return self.desde_jacobiano(multiplicar_generador_jacobiano(coef))
+        # trabajamos en coordenadas jacobianas y solo invertimos al final
+        if USAR_GLV:
+            return self.desde_jacobiano(multiplicación_múltiple_jacobiano(((coef, self),)))
+        return self.desde_jacobiano(multiplicar_jacobiano(coef, self.jacobiano()))
+
+    def jacobiano(self):
+        '''Devuelve las coordenadas jacobianas (X, Y, Z) como enteros'''
+        if self.x is None:
+            return INFINITO_JACOBIANO
+        return (self.x.num, self.y.num, 1)
+
+    @classmethod
+    def desde_jacobiano(cls, p):
+        '''Devuelve el PuntoS256 afín a partir de coordenadas jacobianas'''
+        x, y, z = p
+        if z == 0:
+            return cls(None, None)
+        # la única inversión: x = X/Z**2, y = Y/Z**3
+        z_inv = pow(z, P - 2, P)
+        z_inv2 = z_inv * z_inv % P
+        return cls(campo_s256(x * z_inv2 % P), campo_s256(y * z_inv2 * z_inv % P))
 
     def sec(self, comprimido=True):
         # devuelve la versión binaria del formato SEC, no Hex
@@ -451,15 +664,21 @@ class PuntoS256(Punto):
 
     def verificar(self, z, fir):
         # recuerda fir.r y fir.s son las principales cosas que estamos comprobando
+        # u = z / s, v = r / s y u*G + v*P debería tener r como coordenada x
+        total = self.total_verificación(z, fir)
+        if total[2] == 0:
+            return False
+        return self.desde_jacobiano(total).x.num == fir.r
+
+    def total_verificación(self, z, fir):
+        '''Devuelve u*G + v*self en jacobiano, el punto cuya x debe ser fir.r'''
         # recuerda que 1/s = pow(s, N-2, N)
         s_inv = pow(fir.s, N - 2, N)
         # u = z / s
         u = z * s_inv % N
         # v = r / s
         v = fir.r * s_inv % N
-        # u*G + v*P debería tener r como coordenada x
-        total = u * G + v * self
-        return total.x.num == fir.r
+        return multiplicación_múltiple_jacobiano(((u, G), (v, self)))
 
     @classmethod
     def parsear(self, sec_bin):
@@ -469,28 +688,267 @@ class PuntoS256(Punto):
             x = int(sec_bin[1:33].hex(), 16)
             y = int(sec_bin[33:65].hex(), 16)
             return PuntoS256(x=x, y=y)
-        es_par = sec_bin[0] == 2
-        x = CampoS256(int(sec_bin[1:].hex(), 16))
-        # la parte derecha de la ecuación y^2 = x^3 + 7
-        alpha = x**3 + CampoS256(B)
-        # resuelve para la parte izquierda
-        beta = alpha.sqrt()
-        if beta.num % 2 == 0:
-            beta_par = beta
-            beta_impar = CampoS256(P - beta.num)
-        else:
-            beta_par = CampoS256(P - beta.num)
-            beta_impar = beta
-        if es_par:
-            return PuntoS256(x, beta_par)
-        else:
-            return PuntoS256(x, beta_impar)
+        # el formato comprimido necesita una raíz cuadrada, así que usamos la caché
+        return descomprimir_sec(bytes(sec_bin))
+
+
+# número de claves SEC comprimidas que se recuerdan ya descomprimidas
+TAMAÑO_CACHE_SEC = 4096
+
+
+@lru_cache(maxsize=TAMAÑO_CACHE_SEC)
+def descomprimir_sec(sec_bin):
+    '''Devuelve el PuntoS256 de un SEC comprimido de 33 bytes. Guarda los
+    resultados en una caché LRU: descomprimir_sec.cache_info() da los aciertos
+    y fallos y descomprimir_sec.cache_clear() la vacía'''
+    es_par = sec_bin[0] == 2
+    x = CampoS256(int(sec_bin[1:].hex(), 16))
+    # la parte derecha de la ecuación y^2 = x^3 + 7
+    alpha = x**3 + CampoS256(B)
+    # resuelve para la parte izquierda
+    beta = alpha.sqrt()
+    if beta.num % 2 == 0:
+        beta_par = beta
+        beta_impar = CampoS256(P - beta.num)
+    else:
+        beta_par = CampoS256(P - beta.num)
+        beta_impar = beta
+    if es_par:
+        return PuntoS256(x, beta_par)
+    else:
+        return PuntoS256(x, beta_impar)
 
 
 G = PuntoS256(
     0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
     0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8)
 
+# Tabla de ventanas fija para G: la entrada [i*255 + b - 1] es b * 256**i * G
+# en afín. Así k*G son como mucho 32 sumas y ningún doblado.
+BITS_VENTANA_G = 8
+NÚM_VENTANAS_G = 256 // BITS_VENTANA_G
+TAMAÑO_VENTANA_G = 2**BITS_VENTANA_G - 1
+# si no es None, tabla_generador() carga/guarda la tabla en esta ruta
+RUTA_TABLA_GENERADOR = None
+# sha256 de la tabla guardada por guardar_tabla_generador; cambia si cambia
+# BITS_VENTANA_G. Detecta también puntos de la curva en la posición equivocada
+SHA256_TABLA_GENERADOR = bytes.fromhex('063ba44b38195e8af0d2eb0e2c570d9939e4df16633c19b7c03e54d40eea92dd')
+tabla_g = None
+
+
+def construir_tabla_generador():
+    '''Calcula la tabla de múltiplos de G y la devuelve como lista de (x, y)'''
+    jacobianos = []
+    base = G.jacobiano()
+    for _ in range(NÚM_VENTANAS_G):
+        actual = base
+        for _ in range(TAMAÑO_VENTANA_G):
+            jacobianos.append(actual)
+            actual = sumar_jacobiano(actual, base)
+        # actual es ahora 256 * base, la base de la siguiente ventana
+        base = actual
+    return jacobianos_a_afines(jacobianos)
+
+
+def guardar_tabla_generador(ruta, tabla):
+    '''Escribe la tabla como entradas de 64 bytes x || y en big-endian'''
+    with open(ruta, 'wb') as f:
+        for x, y in tabla:
+            f.write(x.to_bytes(32, 'big') + y.to_bytes(32, 'big'))
+
+
+def cargar_tabla_generador(ruta):
+    '''Lee una tabla escrita por guardar_tabla_generador. Lanza RuntimeError
+    si algún punto no está en la curva o la tabla no es la esperada'''
+    with open(ruta, 'rb') as f:
+        bruto = f.read()
+    if len(bruto) != NÚM_VENTANAS_G * TAMAÑO_VENTANA_G * 64:
+        raise RuntimeError('tabla de G con longitud incorrecta: {}'.format(len(bruto)))
+    tabla = []
+    for i in range(0, len(bruto), 64):
+        x = int.from_bytes(bruto[i:i + 32], 'big')
+        y = int.from_bytes(bruto[i + 32:i + 64], 'big')
+        # los puntos de la tabla no pasan por PuntoS256: compruébalos aquí
+        if x >= P or y >= P or (y * y - x * x * x - B) % P != 0:
+            raise RuntimeError('la entrada {} de la tabla de G no está en la curva'.format(i // 64))
+        tabla.append((x, y))
+    if hashlib.sha256(bruto).digest() != SHA256_TABLA_GENERADOR:
+        raise RuntimeError('la tabla de G no es la esperada')
+    return tabla
+
+
+def tabla_generador():
+    '''Devuelve la tabla de G, construyéndola (o cargándola) la primera vez'''
+    global tabla_g
+    if tabla_g is None:
+        ruta = RUTA_TABLA_GENERADOR
+        if ruta is not None and os.path.exists(ruta):
+            try:
+                tabla_g = cargar_tabla_generador(ruta)
+            except RuntimeError:
+                # tabla dañada: se reconstruye y se sobrescribe abajo
+                tabla_g = None
+        if tabla_g is None:
+            tabla_g = construir_tabla_generador()
+            if ruta is not None:
+                guardar_tabla_generador(ruta, tabla_g)
+    return tabla_g
+
+
+def multiplicar_generador_jacobiano(coef):
+    '''Devuelve coef*G en coordenadas jacobianas usando la tabla fija'''
+    tabla = tabla_generador()
+    coef %= N
+    res = INFINITO_JACOBIANO
+    índice = 0
+    while coef:
+        b = coef & TAMAÑO_VENTANA_G
+        if b:
+            res = sumar_mixto_jacobiano(res, tabla[índice + b - 1])
+        coef >>= BITS_VENTANA_G
+        índice += TAMAÑO_VENTANA_G
+    return res
+
+
+# anchura de ventana wNAF para puntos cualesquiera y para G
+VENTANA_WNAF = 5
+VENTANA_WNAF_G = 8
+tabla_wnaf_g = None
+tabla_wnaf_g_beta = None
+
+
+def wnaf(k, w):
+    '''Devuelve los dígitos wNAF de k, del menos significativo al más.
+    Cada dígito es 0 o impar con valor absoluto menor que 2**(w-1)'''
+    # k negativo: los mismos dígitos que -k, cambiados de signo
+    if k < 0:
+        return [-d for d in wnaf(-k, w)]
+    dígitos = []
+    módulo = 1 << w
+    mitad = 1 << (w - 1)
+    while k:
+        if k & 1:
+            d = k & (módulo - 1)
+            if d >= mitad:
+                d -= módulo
+            k -= d
+        else:
+            d = 0
+        dígitos.append(d)
+        k >>= 1
+    return dígitos
+
+
+def tabla_wnaf(p, w, sumar):
+    '''Devuelve una lista con d*p en la posición d para cada dígito impar d,
+    usando que las posiciones negativas de una lista cuentan desde el final'''
+    tabla = [None] * (1 << w)
+    doble = doblar_jacobiano(p)
+    actual = p
+    for d in range(1, 1 << (w - 1), 2):
+        tabla[d] = actual
+        # -d*p tiene la misma x y la y negada
+        tabla[-d] = (actual[0], P - actual[1]) + actual[2:]
+        actual = sumar(actual, doble)
+    return tabla
+
+
+def tabla_wnaf_generador():
+    '''Devuelve la tabla wNAF de G en afín, calculándola la primera vez'''
+    global tabla_wnaf_g
+    if tabla_wnaf_g is None:
+        tabla = tabla_wnaf(G.jacobiano(), VENTANA_WNAF_G, sumar_jacobiano)
+        # las posiciones de los dígitos pares se quedan en None
+        índices = [d for d, q in enumerate(tabla) if q is not None]
+        afines = jacobianos_a_afines([tabla[d] for d in índices])
+        for d, q in zip(índices, afines):
+            tabla[d] = q
+        tabla_wnaf_g = tabla
+    return tabla_wnaf_g
+
+
+# Endomorfismo de secp256k1: lambda*(x, y) == (beta*x, y). Con él, k*P se
+# parte en k1*P + k2*(lambda*P) con k1 y k2 de unos 128 bits, y la cadena de
+# doblados se reduce a la mitad
+USAR_GLV = True
+BETA_GLV = 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee
+LAMBDA_GLV = 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72
+# base reducida del retículo {(a, b): a + b*lambda == 0 mod N}
+A1_GLV = 0x3086d221a7d46bcde86c90e49284eb15
+B1_GLV = -0xe4437ed6010e88286f547fa90abfe4c3
+A2_GLV = 0x114ca50f7a8e2f3f657c1108d9d44cfd8
+B2_GLV = A1_GLV
+
+
+def descomponer_glv(k):
+    '''Devuelve (k1, k2) con k == k1 + k2*LAMBDA_GLV (mod N) y |k1|, |k2| < 2**128'''
+    # redondea las coordenadas de k en la base del retículo
+    c1 = (B2_GLV * k + N // 2) // N
+    c2 = (-B1_GLV * k + N // 2) // N
+    k1 = k - c1 * A1_GLV - c2 * A2_GLV
+    k2 = -c1 * B1_GLV - c2 * B2_GLV
+    return k1, k2
+
+
+def endomorfismo_tabla(tabla):
+    '''Aplica (x, y) -> (beta*x, y) a cada punto de una tabla wNAF'''
+    res = []
+    for q in tabla:
+        if q is None:
+            res.append(None)
+        else:
+            res.append((BETA_GLV * q[0] % P,) + q[1:])
+    return res
+
+
+def tabla_wnaf_generador_beta():
+    '''Devuelve la tabla wNAF de lambda*G en afín, calculándola la primera vez'''
+    global tabla_wnaf_g_beta
+    if tabla_wnaf_g_beta is None:
+        tabla_wnaf_g_beta = endomorfismo_tabla(tabla_wnaf_generador())
+    return tabla_wnaf_g_beta
+
+
+def multiplicación_múltiple_jacobiano(pares):
+    '''Devuelve la suma de k*punto para cada (k, punto) de pares en jacobiano.
+    Strauss-Shamir: todos los escalares comparten una sola cadena de doblados'''
+    términos = []
+    for k, punto in pares:
+        k %= N
+        if punto.x is None or k == 0:
+            continue
+        if punto.x == G.x and punto.y == G.y:
+            # la tabla de G está en afín, así que usamos la suma mixta
+            ventana, tabla, sumar = VENTANA_WNAF_G, tabla_wnaf_generador(), sumar_mixto_jacobiano
+            es_g = True
+        else:
+            ventana, sumar = VENTANA_WNAF, sumar_jacobiano
+            tabla = tabla_wnaf(punto.jacobiano(), ventana, sumar)
+            es_g = False
+        if USAR_GLV:
+            k1, k2 = descomponer_glv(k)
+            términos.append((wnaf(k1, ventana), tabla, sumar))
+            # la tabla de lambda*G también se guarda: solo se calcula una vez
+            tabla_beta = tabla_wnaf_generador_beta() if es_g else endomorfismo_tabla(tabla)
+            términos.append((wnaf(k2, ventana), tabla_beta, sumar))
+        else:
+            términos.append((wnaf(k, ventana), tabla, sumar))
+    longitud = max((len(dígitos) for dígitos, _, _ in términos), default=0)
+    res = INFINITO_JACOBIANO
+    for i in range(longitud - 1, -1, -1):
+        res = doblar_jacobiano(res)
+        for dígitos, tabla, sumar in términos:
+            if i < len(dígitos):
+                d = dígitos[i]
+                if d:
+                    res = sumar(res, tabla[d])
+    return res
+
+
+def multiplicación_múltiple(pares):
+    '''Devuelve el PuntoS256 suma de k*punto para cada (k, punto) de pares'''
+    return PuntoS256.desde_jacobiano(multiplicación_múltiple_jacobiano(pares))
+
 
 class PruebaS256(TestCase):
 
@@ -580,6 +1038,132 @@ class PruebaS256(TestCase):
         want = 0xa56c896489c71dfc65701ce25050f542f336893fb8cd15f4e8e5c124dbf58e47
         self.assertEqual(punto.y.num, want)
 
+    def prueba_cache_sec(self):
+        sec = bytes.fromhex('0349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278a')
+        descomprimir_sec.cache_clear()
+        primero = PuntoS256.parsear(sec)
+        segundo = PuntoS256.parsear(bytearray(sec))
+        self.assertEqual(primero, segundo)
+        info = descomprimir_sec.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+        self.assertEqual(PuntoS256.parsear(segundo.sec(comprimido=False)), primero)
+
+    def prueba_jacobiano(self):
+        # las coordenadas jacobianas deben dar lo mismo que la aritmética afín
+        for secreto in (1, 2, 3, 1485, 2**128, randint(1, N - 1)):
+            esperado = Punto.__rmul__(G, secreto)
+            self.assertEqual(secreto * G, esperado)
+        p = 1485 * G
+        menos_p = PuntoS256(p.x.num, P - p.y.num)
+        total = sumar_jacobiano(p.jacobiano(), menos_p.jacobiano())
+        self.assertIsNone(PuntoS256.desde_jacobiano(total).x)
+        total = sumar_jacobiano(p.jacobiano(), p.jacobiano())
+        self.assertEqual(PuntoS256.desde_jacobiano(total), p + p)
+
+    def prueba_tabla_generador(self):
+        for secreto in (1, 255, 256, 2**255, N - 1, randint(1, N - 1)):
+            esperado = multiplicar_jacobiano(secreto, G.jacobiano())
+            self.assertEqual(
+                PuntoS256.desde_jacobiano(multiplicar_generador_jacobiano(secreto)),
+                PuntoS256.desde_jacobiano(esperado))
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'tabla_g.bin')
+            guardar_tabla_generador(ruta, tabla_generador())
+            self.assertEqual(cargar_tabla_generador(ruta), tabla_generador())
+
+    def prueba_tabla_generador_dañada(self):
+        global RUTA_TABLA_GENERADOR, tabla_g
+        correcta = tabla_generador()
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'tabla_g.bin')
+            # un bit cambiado en la entrada 300 saca el punto de la curva
+            guardar_tabla_generador(ruta, correcta)
+            with open(ruta, 'r+b') as f:
+                f.seek(300 * 64 + 10)
+                byte = f.read(1)[0]
+                f.seek(300 * 64 + 10)
+                f.write(bytes([byte ^ 1]))
+            with self.assertRaises(RuntimeError):
+                cargar_tabla_generador(ruta)
+            # dos puntos de la curva intercambiados solo los detecta el hash
+            cambiada = list(correcta)
+            cambiada[300], cambiada[301] = cambiada[301], cambiada[300]
+            guardar_tabla_generador(ruta, cambiada)
+            with self.assertRaises(RuntimeError):
+                cargar_tabla_generador(ruta)
+            # tabla_generador reconstruye la tabla y sobrescribe el fichero
+            ruta_original, tabla_original = RUTA_TABLA_GENERADOR, tabla_g
+            RUTA_TABLA_GENERADOR, tabla_g = ruta, None
+            try:
+                self.assertEqual(tabla_generador(), correcta)
+                self.assertEqual(cargar_tabla_generador(ruta), correcta)
+                _, _, dire = next(derivar_direcciones([46 * 256]))
+                self.assertEqual(dire, ClavePrivada(46 * 256).punto.dire())
+            finally:
+                RUTA_TABLA_GENERADOR, tabla_g = ruta_original, tabla_original
+
+    def prueba_campo_s256(self):
+        a = CampoS256(G.x.num)
+        b = CampoS256(G.y.num)
+        ea = ElementoCampo(G.x.num, P)
+        eb = ElementoCampo(G.y.num, P)
+        for x, y in ((a + b, ea + eb), (a - b, ea - eb), (a * b, ea * eb),
+                     (a / b, ea / eb), (a**-3, ea**-3), (5 * a, 5 * ea)):
+            self.assertEqual(type(x), CampoS256)
+            self.assertEqual(x.num, y.num)
+            self.assertEqual(x.primo, P)
+        self.assertFalse(hasattr(a, '__dict__'))
+        with self.assertRaises(ValueError):
+            CampoS256(P)
+        with self.assertRaises(ValueError):
+            PuntoS256(G.x.num, G.y.num + 1)
+
+    def prueba_wnaf(self):
+        for k in (1, 7, 2**128, N - 1, randint(1, N - 1)):
+            for w in (2, VENTANA_WNAF, VENTANA_WNAF_G):
+                dígitos = wnaf(k, w)
+                self.assertEqual(sum(d << i for i, d in enumerate(dígitos)), k)
+                for d in dígitos:
+                    self.assertTrue(d == 0 or (d % 2 == 1 and abs(d) < 2**(w - 1)))
+
+    def prueba_glv(self):
+        self.assertEqual(LAMBDA_GLV * G, PuntoS256(BETA_GLV * G.x.num % P, G.y.num))
+        for k in (0, 1, N - 1, 2**128, randint(1, N - 1)):
+            k1, k2 = descomponer_glv(k)
+            self.assertEqual((k1 + k2 * LAMBDA_GLV) % N, k)
+            self.assertLessEqual(abs(k1).bit_length(), 128)
+            self.assertLessEqual(abs(k2).bit_length(), 128)
+        p = 1485 * G
+        k, u = randint(1, N - 1), randint(1, N - 1)
+        self.assertEqual(k * p, PuntoS256.desde_jacobiano(multiplicar_jacobiano(k, p.jacobiano())))
+        # con y sin GLV el resultado tiene que ser el mismo
+        global USAR_GLV
+        con_glv = multiplicación_múltiple(((u, G), (k, p)))
+        USAR_GLV = False
+        try:
+            self.assertEqual(multiplicación_múltiple(((u, G), (k, p))), con_glv)
+        finally:
+            USAR_GLV = True
+
+    def prueba_multiplicación_múltiple(self):
+        p = 1485 * G
+        for u, v in ((0, 0), (1, 0), (0, 5), (3, N - 3), (randint(1, N - 1), randint(1, N - 1))):
+            self.assertEqual(multiplicación_múltiple(((u, G), (v, p))), u * G + v * p)
+        q = 2**128 * G
+        u, v, w = randint(1, N - 1), randint(1, N - 1), randint(1, N - 1)
+        self.assertEqual(
+            multiplicación_múltiple(((u, G), (v, p), (w, q))),
+            u * G + v * p + w * q)
+
+    def prueba_tabla_wnaf_generador_beta(self):
+        tabla = tabla_wnaf_generador_beta()
+        # se calcula una sola vez y es la tabla de lambda*G
+        self.assertIs(tabla_wnaf_generador_beta(), tabla)
+        esperada = tabla_wnaf_generador()
+        for d in (1, 3, -1, 1 - (1 << (VENTANA_WNAF_G - 1))):
+            x, y = esperada[d]
+            self.assertEqual(tabla[d], (BETA_GLV * x % P, y))
+
 
 class Firma:
 
@@ -649,13 +1233,38 @@ class ClavePrivada:
     def __init__(self, secreto):
         self.secreto = secreto
         self.punto = secreto * G
+        # la primera vuelta del HMAC del RFC 6979 solo depende de la clave:
+        # la preparamos una vez y la copiamos para cada z
+        self.secreto_bytes = (secreto % N).to_bytes(32, 'big')
+        self.hmac_inicial = hmac.new(
+            b'\x00' * 32, b'\x01' * 32 + b'\x00' + self.secreto_bytes, hashlib.sha256)
 
     def hex(self):
         return '{:x}'.format(self.secreto).zfill(64)
 
+    def k_determinista(self, z):
+        '''Devuelve el k del RFC 6979 para z: siempre el mismo para la misma
+        clave y el mismo z'''
+        z_bytes = (z % N).to_bytes(32, 'big')
+        v = b'\x01' * 32
+        # k = HMAC_k(v || 0x00 || secreto || z), con k y v iniciales ya absorbidos
+        h = self.hmac_inicial.copy()
+        h.update(z_bytes)
+        k = h.digest()
+        v = hmac.digest(k, v, 'sha256')
+        k = hmac.digest(k, v + b'\x01' + self.secreto_bytes + z_bytes, 'sha256')
+        v = hmac.digest(k, v, 'sha256')
+        while True:
+            v = hmac.digest(k, v, 'sha256')
+            candidato = int.from_bytes(v, 'big')
+            if 1 <= candidato < N:
+                return candidato
+            k = hmac.digest(k, v + b'\x00', 'sha256')
+            v = hmac.digest(k, v, 'sha256')
+
     def firmar(self, z):
-        # necesitamos un número aleatorio k: randint(0, 2**256)
-        k = randint(0, 2**256)
+        # k determinista según el RFC 6979
+        k = self.k_determinista(z)
         # r es la coordenada x del punto resultante k*G
         r = (k * G).x.num
         # recuerda 1/k = pow(k, N-2, N)
@@ -676,3 +1285,154 @@ class PruebaClavePrivada(TestCase):
         z = randint(0, 2**256)
         fir = pk.firmar(z)
         self.assertTrue(pk.punto.verificar(z, fir))
+
+    def prueba_k_determinista(self):
+        # vector de prueba conocido de RFC 6979 sobre secp256k1
+        pk = ClavePrivada(1)
+        z = int.from_bytes(hashlib.sha256(b'Satoshi Nakamoto').digest(), 'big')
+        want = 0x8f8a276c19f4149656b280621e358cce24f5f52542772691ee69063b74f15d15
+        self.assertEqual(pk.k_determinista(z), want)
+        # misma clave y mismo z dan siempre la misma firma
+        pk = ClavePrivada(randint(1, N - 1))
+        z = randint(0, 2**256)
+        fir1, fir2 = pk.firmar(z), pk.firmar(z)
+        self.assertEqual((fir1.r, fir1.s), (fir2.r, fir2.s))
+        self.assertNotEqual(pk.k_determinista(z), pk.k_determinista(z + 1))
+
+
+# por debajo de este número de firmas no compensa arrancar procesos
+MÍNIMO_LOTE_PROCESOS = 64
+# firmas que se envían juntas a cada proceso
+TAMAÑO_TROZO_LOTE = 32
+
+
+def verificar_trozo(trozo):
+    '''Verifica en este proceso una lista de (x, y, z, r, s) y devuelve
+    la lista de resultados'''
+    totales = []
+    for x, y, z, r, s in trozo:
+        totales.append(PuntoS256(x, y).total_verificación(z, Firma(r, s)))
+    # una sola inversión para pasar a afín todos los puntos del trozo
+    afines = jacobianos_a_afines(totales)
+    res = []
+    for afín, (_, _, _, r, _) in zip(afines, trozo):
+        res.append(afín is not None and afín[0] == r)
+    return res
+
+
+def verificar_lote(elementos, procesos=None, tamaño_trozo=TAMAÑO_TROZO_LOTE,
+                   mínimo_procesos=MÍNIMO_LOTE_PROCESOS):
+    '''Verifica una lista de (punto, z, firma) repartiéndola entre procesos.
+    Devuelve una lista de booleanos en el mismo orden'''
+    # a los procesos les mandamos enteros, que se serializan más rápido
+    tareas = []
+    for punto, z, firma in elementos:
+        tareas.append((punto.x.num, punto.y.num, z, firma.r, firma.s))
+    # para lotes pequeños lo hacemos aquí mismo
+    if len(tareas) < mínimo_procesos or procesos == 1:
+        return verificar_trozo(tareas)
+    trozos = [tareas[i:i + tamaño_trozo] for i in range(0, len(tareas), tamaño_trozo)]
+    res = []
+    with ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+        # map devuelve los resultados en el orden de los trozos
+        for resultados in ejecutor.map(verificar_trozo, trozos):
+            res.extend(resultados)
+    return res
+
+
+class PruebaVerificarLote(TestCase):
+
+    def prueba_verificar_lote(self):
+        elementos = []
+        esperado = []
+        for i in range(6):
+            clave = ClavePrivada(randint(1, N - 1))
+            z = randint(0, 2**256)
+            fir = clave.firmar(z)
+            # estropea una de cada tres firmas
+            if i % 3 == 2:
+                z += 1
+            elementos.append((clave.punto, z, fir))
+            esperado.append(i % 3 != 2)
+        self.assertEqual(verificar_lote(elementos), esperado)
+        self.assertEqual(
+            verificar_lote(elementos, procesos=2, tamaño_trozo=2, mínimo_procesos=0),
+            esperado)
+
+
+# puntos que se pasan a afín con una sola inversión al derivar en bloque
+TAMAÑO_LOTE_DERIVAR = 256
+
+
+def direcciones_lote(secretos, jacobianos, comprimido, testnet):
+    '''Genera (secreto, sec, dire) para cada secreto y su punto jacobiano'''
+    if testnet:
+        prefijo = b'\x6f'
+    else:
+        prefijo = b'\x00'
+    for secreto, afín in zip(secretos, jacobianos_a_afines(jacobianos)):
+        if afín is None:
+            raise ValueError('el secreto {} da el punto en el infinito'.format(secreto))
+        x, y = afín
+        if not comprimido:
+            sec = b'\x04' + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+        elif y % 2 == 0:
+            sec = b'\x02' + x.to_bytes(32, 'big')
+        else:
+            sec = b'\x03' + x.to_bytes(32, 'big')
+        yield secreto, sec, codificar_base58_checksum(prefijo + hash160(sec))
+
+
+def derivar_direcciones(secretos, comprimido=True, testnet=False,
+                        tamaño_lote=TAMAÑO_LOTE_DERIVAR):
+    '''Generador de (secreto, sec, dire) para cada secreto del iterable.
+    Usa la tabla de G y pasa los puntos a afín por lotes'''
+    lote = []
+    for secreto in secretos:
+        lote.append(secreto)
+        if len(lote) == tamaño_lote:
+            puntos = [multiplicar_generador_jacobiano(s) for s in lote]
+            yield from direcciones_lote(lote, puntos, comprimido, testnet)
+            lote = []
+    if lote:
+        puntos = [multiplicar_generador_jacobiano(s) for s in lote]
+        yield from direcciones_lote(lote, puntos, comprimido, testnet)
+
+
+def derivar_rango(inicio, cantidad, comprimido=True, testnet=False,
+                  tamaño_lote=TAMAÑO_LOTE_DERIVAR):
+    '''Generador de (secreto, sec, dire) para los secretos inicio, inicio+1, ...
+    Solo el primero se multiplica: el resto se obtiene sumando G'''
+    g = (G.x.num, G.y.num)
+    actual = multiplicar_generador_jacobiano(inicio)
+    secretos, puntos = [], []
+    for secreto in range(inicio, inicio + cantidad):
+        secretos.append(secreto)
+        puntos.append(actual)
+        # (secreto+1)*G = secreto*G + G
+        actual = sumar_mixto_jacobiano(actual, g)
+        if len(secretos) == tamaño_lote:
+            yield from direcciones_lote(secretos, puntos, comprimido, testnet)
+            secretos, puntos = [], []
+    if secretos:
+        yield from direcciones_lote(secretos, puntos, comprimido, testnet)
+
+
+class PruebaDerivar(TestCase):
+
+    def prueba_derivar_direcciones(self):
+        secretos = [888**3, 321, 4242424242, randint(1, N - 1), randint(1, N - 1)]
+        for comprimido, testnet in ((True, False), (False, True)):
+            res = list(derivar_direcciones(secretos, comprimido, testnet, tamaño_lote=2))
+            self.assertEqual([s for s, _, _ in res], secretos)
+            for secreto, sec, dire in res:
+                punto = ClavePrivada(secreto).punto
+                self.assertEqual(sec, punto.sec(comprimido))
+                self.assertEqual(dire, punto.dire(comprimido, testnet))
+
+    def prueba_derivar_rango(self):
+        inicio = randint(1, N - 100)
+        res = list(derivar_rango(inicio, 7, tamaño_lote=3))
+        esperado = list(derivar_direcciones(range(inicio, inicio + 7)))
+        self.assertEqual(res, esperado)
+        self.assertEqual(res[0][2], ClavePrivada(inicio).punto.dire())
@@ -7,11 +7,11 @@ from unittest import TestCase
 
 from bloque import Bloque
 from ayudante import (
+    a_lector,
     doble_sha256,
-    codificar_varint,
+    EscritorBytes,
     int_a_little_endian,
-    little_endian_a_int,
-    read_varint,
+    LectorBytes,
 )
 
 TIPO_DATOS_TX = 1
@@ -42,6 +42,7 @@ class NetworkEnvelope:
     @classmethod
     def parsear(cls, s, testnet=False):
         '''Toma un stream y crea un NetworkEnvelope'''
+        s = a_lector(s)
         # comprueba la magia de red
         magia = s.read(4)
         if magia == b'':
@@ -57,7 +58,7 @@ class NetworkEnvelope:
         # quita los 0's arrastrados
         comando = comando.strip(b'\x00')
         # longitud de carga 4 bytes, little endian
-        longitud_carga = little_endian_a_int(s.read(4))
+        longitud_carga = s.read_u32()
         # checksum es 4 bytes, los primeros cuatro del doble_sha256 de carga
         checksum = s.read(4)
         # carga es de longitud longitud_carga
@@ -70,22 +71,28 @@ class NetworkEnvelope:
 
     def serializar(self):
         '''Devuelve la serialización en bytes del mensaje de red completo'''
+        escritor = EscritorBytes()
+        self.serializar_en(escritor)
+        return escritor.getvalue()
+
+    def serializar_en(self, escritor):
+        '''Escribe el mensaje de red completo en el EscritorBytes'''
         # añade la magia de red
-        res = self.magia
+        escritor.write(self.magia)
         # comando 12 bytes
         # rellénalo con 0's
-        res += self.comando + b'\x00' * (12 - len(self.comando))
+        escritor.write(self.comando)
+        escritor.write(b'\x00' * (12 - len(self.comando)))
         # la longitud de carga son 4 bytes, little endian
-        res += int_a_little_endian(len(self.carga), 4)
+        escritor.write_u32_le(len(self.carga))
         # checksum 4 bytes, los primeros cuatro de doble_sha256 de carga
-        res += doble_sha256(self.carga)[:4]
+        escritor.write(doble_sha256(self.carga)[:4])
         # carga
-        res += self.carga
-        return res
+        escritor.write(self.carga)
 
     def stream(self):
         '''Devuelve un stream para parsear la carga'''
-        return BytesIO(self.carga)
+        return LectorBytes(self.carga)
 
 
 class PruebaNetworkEnvelope(TestCase):
@@ -145,37 +152,44 @@ class MensajeVersión:
 
     def serializar(self):
         '''Serializa este mensaje para enviarlo a la red'''
+        escritor = EscritorBytes()
+        self.serializar_en(escritor)
+        return escritor.getvalue()
+
+    def serializar_en(self, escritor):
+        '''Escribe este mensaje en el EscritorBytes'''
         # versión es 4 bytes little endian
-        res = int_a_little_endian(self.versión, 4)
+        escritor.write_u32_le(self.versión)
         # servicios tiene 8 bytes little endian
-        res += int_a_little_endian(self.servicios, 8)
+        escritor.write_u64_le(self.servicios)
         # timestamp es 8 bytes little endian
-        res += int_a_little_endian(self.timestamp, 8)
+        escritor.write_u64_le(self.timestamp)
         # servicios receptor son 8 bytes little endian
-        res += int_a_little_endian(self.servicios_receptor, 8)
+        escritor.write_u64_le(self.servicios_receptor)
         # IPV4 es 10 00 bytes y 2 ff bytes después ip receptor
-        res += b'\x00' * 10 + b'\xff\xff' + self.ip_receptor
+        escritor.write(b'\x00' * 10 + b'\xff\xff')
+        escritor.write(self.ip_receptor)
         # puerto receptor son 2 bytes, little endian debería ser 0
-        res += int_a_little_endian(self.puerto_receptor, 2)
+        escritor.write_u16_le(self.puerto_receptor)
         # servicios emisor son 8 bytes little endian
-        res += int_a_little_endian(self.servicios_emisor, 8)
+        escritor.write_u64_le(self.servicios_emisor)
         # IPV4 son los bytes 10 00 y 2 ff bytes luego ip emisor
-        res += b'\x00' * 10 + b'\xff\xff' + self.ip_emisor
+        escritor.write(b'\x00' * 10 + b'\xff\xff')
+        escritor.write(self.ip_emisor)
         # puerto emisor son 2 bytes, little endian debería ser 0
-        res += int_a_little_endian(self.puerto_emisor, 2)
+        escritor.write_u16_le(self.puerto_emisor)
         # nonce deberían ser 8 bytes
-        res += self.nonce
+        escritor.write(self.nonce)
         # agente usuario es una cadena variable, así que varint primero
-        res += codificar_varint(len(self.agente_usuario))
-        res += self.agente_usuario
+        escritor.write_varint(len(self.agente_usuario))
+        escritor.write(self.agente_usuario)
         # el último bloque son 4 bytes little endian
-        res += int_a_little_endian(self.último_bloque, 4)
+        escritor.write_u32_le(self.último_bloque)
         # retransmisión es 00 si es falso, 01 si es verdadero
         if self.retransmisión:
-            res += b'\x01'
+            escritor.write_u8(1)
         else:
-            res += b'\x00'
-        return res
+            escritor.write_u8(0)
 
 
 class PruebaMensajeVersión(TestCase):
@@ -201,15 +215,20 @@ class ObtenerMensajeCabeceras:
 
     def serializar(self):
         '''Serializa este mensaje para enviarlo a la red'''
+        escritor = EscritorBytes()
+        self.serializar_en(escritor)
+        return escritor.getvalue()
+
+    def serializar_en(self, escritor):
+        '''Escribe este mensaje en el EscritorBytes'''
         # la versión del protocolo es 4 bytes little-endian
-        res = int_a_little_endian(self.versión, 4)
+        escritor.write_u32_le(self.versión)
         # el número de hashes es un varint
-        res += codificar_varint(self.num_hashes)
+        escritor.write_varint(self.num_hashes)
         # el bloque inicial es en little-endian
-        res += self.bloque_inicial[::-1]
+        escritor.write_hash(self.bloque_inicial)
         # el bloque final es también en little-endian
-        res += self.bloque_final[::-1]
-        return res
+        escritor.write_hash(self.bloque_final)
 
 
 class PruebaObtenerMensajeCabeceras(TestCase):
@@ -228,8 +247,9 @@ class MensajeCabeceras:
 
     @classmethod
     def parsear(cls, stream):
+        stream = a_lector(stream)
         # el número de cabeceras está en un varint
-        num_cabeceras = read_varint(stream)
+        num_cabeceras = stream.read_varint()
         # inicializa el array de bloques
         bloques = []
         # haz un bucle tantas veces como número de cabeceras
@@ -237,7 +257,7 @@ class MensajeCabeceras:
             # añade un bloque al array de bloques a base de parsear el stream
             bloques.append(Bloque.parsear(stream))
             # lee el siguiente varint (num_txs)
-            num_txs = read_varint(stream)
+            num_txs = stream.read_varint()
             # num_txs debería ser 0 o dar un RuntimeError
             if num_txs != 0:
                 raise RuntimeError('el número de txs no es 0')
@@ -266,14 +286,20 @@ class ObtenerDatosMensaje:
         self.data.append((tipo_datos, identificador))
 
     def serializar(self):
+        '''Serializa este mensaje para enviarlo a la red'''
+        escritor = EscritorBytes()
+        self.serializar_en(escritor)
+        return escritor.getvalue()
+
+    def serializar_en(self, escritor):
+        '''Escribe este mensaje en el EscritorBytes'''
         # comienza con el número de cosas como un varint
-        res = codificar_varint(len(self.data))
+        escritor.write_varint(len(self.data))
         for tipo_datos, identificador in self.data:
             # tipo de datos es 4 bytes little endian
-            res += int_a_little_endian(tipo_datos, 4)
+            escritor.write_u32_le(tipo_datos)
             # identificador necesita estar en little endian
-            res += identificador[::-1]
-        return res
+            escritor.write_hash(identificador)
 
 
 class PruebaObtenerDatosMensaje(TestCase):
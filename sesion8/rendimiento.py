@@ -0,0 +1,409 @@
+'''Mediciones de rendimiento. Ejecuta: python rendimiento.py'''
+import os
+import tempfile
+import time
+import tracemalloc
+
+from io import BytesIO
+from random import randint
+
+import ayudante
+import cce
+from ayudante import (
+    EscritorBytes,
+    LectorBytes,
+    a_lector,
+    codificar_varint,
+    doble_sha256_lote,
+    hash160,
+    ÁrbolMerkleCompleto,
+    nivel_padre_merkle,
+    raíz_merkle,
+)
+from bloomfilter import BloomFilter
+from bloque import Bloque
+from cce import (
+    G,
+    N,
+    P,
+    CampoS256,
+    ClavePrivada,
+    ElementoCampo,
+    Firma,
+    Punto,
+    PuntoS256,
+    derivar_rango,
+    invertir_lote,
+    multiplicación_múltiple_jacobiano,
+    multiplicar_generador_jacobiano,
+    multiplicar_jacobiano,
+    sumar_jacobiano,
+)
+from script import Script, decodificar_cosas, script_p2pkh
+from tx import Tx
+
+
+# los mismos secretos que usa PruebaS256.prueba_puntopub
+SECRETOS_PRUEBA = (7, 1485, 2**128, 2**240 + 2**31)
+
+
+def medir(función, repeticiones=1):
+    '''Devuelve los segundos por repetición de llamar a función()'''
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        función()
+    return (time.perf_counter() - inicio) / repeticiones
+
+
+def informar(nombre, antes, después):
+    print('{}: {:.2f} µs -> {:.2f} µs ({:.1f}x)'.format(
+        nombre, antes * 1e6, después * 1e6, antes / después))
+
+
+def rendimiento_multiplicación_escalar(repeticiones=5):
+    '''Compara secreto*G afín (una inversión por paso) con el jacobiano'''
+    def afín():
+        for secreto in SECRETOS_PRUEBA:
+            Punto.__rmul__(G, secreto)
+
+    def jacobiano():
+        for secreto in SECRETOS_PRUEBA:
+            secreto * G
+
+    # la tabla de G se construye una sola vez, fuera de la medición
+    cce.tabla_generador()
+    informar('secreto*G', medir(afín, repeticiones), medir(jacobiano, repeticiones))
+
+
+def rendimiento_tabla_generador(repeticiones=20):
+    '''Compara k*G con doblar y sumar frente a la tabla fija de G'''
+    construir = medir(cce.construir_tabla_generador)
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'tabla_g.bin')
+        cce.guardar_tabla_generador(ruta, cce.tabla_generador())
+        cargar = medir(lambda: cce.cargar_tabla_generador(ruta))
+    informar('tabla de G (construir -> cargar)', construir, cargar)
+
+    def doblar_y_sumar():
+        for secreto in SECRETOS_PRUEBA:
+            PuntoS256.desde_jacobiano(multiplicar_jacobiano(secreto, G.jacobiano()))
+
+    def tabla():
+        for secreto in SECRETOS_PRUEBA:
+            PuntoS256.desde_jacobiano(multiplicar_generador_jacobiano(secreto))
+
+    informar('k*G con tabla', medir(doblar_y_sumar, repeticiones), medir(tabla, repeticiones))
+
+
+def rendimiento_verificar(repeticiones=20):
+    '''Compara u*G + v*P por separado frente a Strauss-Shamir'''
+    clave = ClavePrivada(12345)
+    punto = clave.punto
+    z = 0xec208baa0fc1c19f708a9ca96fdeff3ac3f230bb4a7ba4aede4942ad003c0f60
+    fir = clave.firmar(z)
+    s_inv = pow(fir.s, N - 2, N)
+    u = z * s_inv % N
+    v = fir.r * s_inv % N
+    cce.tabla_wnaf_generador()
+    cce.tabla_wnaf_generador_beta()
+
+    def por_separado():
+        sumar_jacobiano(
+            multiplicar_generador_jacobiano(u),
+            multiplicar_jacobiano(v, punto.jacobiano()))
+
+    def conjunta():
+        multiplicación_múltiple_jacobiano(((u, G), (v, punto)))
+
+    informar('u*G + v*P', medir(por_separado, repeticiones), medir(conjunta, repeticiones))
+
+
+def rendimiento_invertir_lote(cantidad=1000):
+    '''Compara una exponenciación por elemento con invertir_lote'''
+    números = [randint(1, P - 1) for _ in range(cantidad)]
+
+    def uno_a_uno():
+        for n in números:
+            pow(n, P - 2, P)
+
+    informar('invertir {} elementos'.format(cantidad),
+             medir(uno_a_uno), medir(lambda: invertir_lote(números, P)))
+
+
+def rendimiento_glv(repeticiones=20):
+    '''Compara k*P y verificar con y sin la descomposición GLV'''
+    punto = 1485 * G
+    clave = ClavePrivada(12345)
+    z = 0xec208baa0fc1c19f708a9ca96fdeff3ac3f230bb4a7ba4aede4942ad003c0f60
+    fir = clave.firmar(z)
+    # escalares de 256 bits: los de SECRETOS_PRUEBA tienen muy pocos bits a 1
+    secretos = [randint(1, N - 1) for _ in range(4)]
+
+    def multiplicar():
+        for secreto in secretos:
+            secreto * punto
+
+    def verificar():
+        clave.punto.verificar(z, fir)
+
+    for nombre, función in (('k*P', multiplicar), ('verificar', verificar)):
+        cce.USAR_GLV = False
+        sin_glv = medir(función, repeticiones)
+        cce.USAR_GLV = True
+        con_glv = medir(función, repeticiones)
+        informar('{} con GLV'.format(nombre), sin_glv, con_glv)
+
+
+def rendimiento_campo(repeticiones=20000):
+    '''Compara la aritmética de ElementoCampo genérico con CampoS256'''
+    def operar(x, y):
+        def función():
+            # la ecuación de la curva y algunas operaciones sueltas
+            y * y - x * x * x - (x + y) * (x - y)
+        return función
+
+    genérico = operar(ElementoCampo(G.x.num, P), ElementoCampo(G.y.num, P))
+    s256 = operar(CampoS256(G.x.num), CampoS256(G.y.num))
+    informar('operaciones de campo', medir(genérico, repeticiones), medir(s256, repeticiones))
+
+    a, b = ElementoCampo(0, P), ElementoCampo(7, P)
+
+    def punto_genérico():
+        Punto(ElementoCampo(G.x.num, P), ElementoCampo(G.y.num, P), a, b)
+
+    def punto_s256():
+        PuntoS256(G.x.num, G.y.num)
+
+    informar('crear punto', medir(punto_genérico, repeticiones), medir(punto_s256, repeticiones))
+
+
+def rendimiento_derivar(cantidad=500):
+    '''Compara ClavePrivada(s).punto.dire() uno a uno con derivar_rango'''
+    inicio = randint(1, N - cantidad)
+    cce.tabla_generador()
+
+    def uno_a_uno():
+        for secreto in range(inicio, inicio + cantidad):
+            ClavePrivada(secreto).punto.dire()
+
+    def en_bloque():
+        for _ in derivar_rango(inicio, cantidad):
+            pass
+
+    informar('derivar {} direcciones'.format(cantidad), medir(uno_a_uno), medir(en_bloque))
+
+
+# cabecera de PruebaBloque y la tx de PruebaTx, para montar un bloque grande
+CABECERA_PRUEBA = bytes.fromhex('020000208ec39428b17323fa0ddec8e887b4a7c53b8c0a0a220cfd0000000000000000005b0750fce0a889502d40508d39576821155e9c9e3f5c3157f961db38fd8b25be1e77a759e93c0118a4ffd71d')
+TX_PRUEBA = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
+
+
+def parsear_bloque_completo(s):
+    '''Parsea la cabecera y todas las txs de un bloque'''
+    s = a_lector(s)
+    bloque = Bloque.parsear(s)
+    bloque.txs = [Tx.parsear(s) for _ in range(s.read_varint())]
+    return bloque
+
+
+def rendimiento_parsear(cantidad=5000, repeticiones=3):
+    '''Compara parsear un bloque grande desde BytesIO y desde LectorBytes'''
+    bruto = CABECERA_PRUEBA + codificar_varint(cantidad) + TX_PRUEBA * cantidad
+    stream = medir(lambda: parsear_bloque_completo(BytesIO(bruto)), repeticiones)
+    lector = medir(lambda: parsear_bloque_completo(LectorBytes(bruto)), repeticiones)
+    informar('parsear bloque de {} txs'.format(cantidad), stream, lector)
+    print('  {:.1f} MB/s -> {:.1f} MB/s'.format(len(bruto) / stream / 1e6, len(bruto) / lector / 1e6))
+
+
+def rendimiento_script_perezoso(cantidad=5000, repeticiones=3):
+    '''Compara parsear y volver a serializar un bloque decodificando todos los
+    scripts frente a copiar sus bytes originales sin decodificarlos'''
+    bruto = CABECERA_PRUEBA + codificar_varint(cantidad) + TX_PRUEBA * cantidad
+
+    def ida_y_vuelta(decodificar):
+        bloque = parsear_bloque_completo(bruto)
+        escritor = EscritorBytes()
+        for tx in bloque.txs:
+            if decodificar:
+                # como antes: cosas decodificadas y serialización reconstruida
+                for tx_in in tx.tx_ins:
+                    tx_in.script_sig.cosas = tx_in.script_sig.cosas
+                for tx_out in tx.tx_outs:
+                    tx_out.script_pubkey.cosas = tx_out.script_pubkey.cosas
+            tx.serializar_en(escritor)
+        return escritor.getvalue()
+
+    informar('parsear y serializar bloque de {} txs'.format(cantidad),
+             medir(lambda: ida_y_vuelta(True), repeticiones),
+             medir(lambda: ida_y_vuelta(False), repeticiones))
+
+
+def rendimiento_clasificar(cantidad=5000, repeticiones=3):
+    '''Compara clasificar los outputs de un bloque decodificando sus cosas con
+    comparar los bytes del script con las plantillas'''
+    bloque = parsear_bloque_completo(CABECERA_PRUEBA + codificar_varint(cantidad) + TX_PRUEBA * cantidad)
+    scripts = [tx_out.script_pubkey for tx in bloque.txs for tx_out in tx.tx_outs]
+
+    def contando_cosas():
+        # como lo hacía Script.dire: decodifica y cuenta los elementos
+        res = []
+        for script in scripts:
+            cosas = decodificar_cosas(script.bruto)
+            if len(cosas) == 5 and cosas[0] == 0x76 and cosas[1] == 0xa9 \
+                    and cosas[3] == 0x88 and cosas[4] == 0xac:
+                res.append(('p2pkh', cosas[2]))
+            elif len(cosas) == 3 and cosas[0] == 0xa9 and cosas[2] == 0x87:
+                res.append(('p2sh', cosas[1]))
+            else:
+                res.append(None)
+        return res
+
+    informar('clasificar {} outputs'.format(len(scripts)),
+             medir(contando_cosas, repeticiones),
+             medir(lambda: [script.clasificar() for script in scripts], repeticiones))
+
+
+def rendimiento_serializar(cantidad=5000, repeticiones=3):
+    '''Compara concatenar bytes con escribir en un único EscritorBytes'''
+    tx = Tx.parsear(TX_PRUEBA)
+    tx.tx_ins = tx.tx_ins * cantidad
+    tx.tx_outs = tx.tx_outs * cantidad
+
+    def concatenar():
+        # como lo hacía Tx.serializar: res += ... sobre bytes inmutables
+        res = tx.versión.to_bytes(4, 'little') + codificar_varint(len(tx.tx_ins))
+        for tx_in in tx.tx_ins:
+            res += tx_in.serializar()
+        res += codificar_varint(len(tx.tx_outs))
+        for tx_out in tx.tx_outs:
+            res += tx_out.serializar()
+        return res + tx.locktime.to_bytes(4, 'little')
+
+    informar('serializar tx de {} inputs y outputs'.format(cantidad),
+             medir(concatenar, repeticiones), medir(tx.serializar, repeticiones))
+
+
+def pico_memoria(función):
+    '''Devuelve el pico de memoria en MB que reserva función()'''
+    tracemalloc.start()
+    función()
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return pico / 1e6
+
+
+def rendimiento_merkle(cantidad=10**6):
+    '''Compara la raíz merkle con una lista por nivel frente a bytes contiguos'''
+    hashes = [os.urandom(32) for _ in range(cantidad)]
+
+    def listas():
+        nivel = hashes
+        while len(nivel) > 1:
+            nivel = nivel_padre_merkle(nivel)
+        return nivel[0]
+
+    informar('raíz merkle de {} hojas'.format(cantidad),
+             medir(listas), medir(lambda: raíz_merkle(hashes)))
+    print('  pico de memoria: {:.0f} MB -> {:.0f} MB'.format(
+        pico_memoria(listas), pico_memoria(lambda: raíz_merkle(hashes))))
+
+
+def rendimiento_árbol_merkle(cantidad=10**5, repeticiones=100):
+    '''Compara recalcular la raíz entera con actualizar una hoja del árbol'''
+    hashes = [os.urandom(32) for _ in range(cantidad)]
+    árbol = ÁrbolMerkleCompleto(hashes)
+    índice = randint(0, cantidad - 1)
+
+    def actualizar():
+        árbol.actualizar(índice, os.urandom(32))
+
+    informar('cambiar una hoja de {}'.format(cantidad),
+             medir(lambda: raíz_merkle(hashes)), medir(actualizar, repeticiones))
+    informar('prueba de inclusión',
+             medir(lambda: raíz_merkle(hashes)),
+             medir(lambda: árbol.prueba_inclusión(índice), repeticiones))
+
+
+def rendimiento_bloom(cantidad=20000):
+    '''Compara añadir al filtro bloom una cosa cada vez con add_lote'''
+    cosas = [os.urandom(20) for _ in range(cantidad)]
+
+    def uno_a_uno():
+        bf = BloomFilter(1000, 5, 99)
+        for cosa in cosas:
+            bf.add(cosa)
+
+    def en_lote():
+        BloomFilter(1000, 5, 99).add_lote(cosas)
+
+    nombre = 'filtro bloom de {} cosas (numpy: {})'.format(cantidad, ayudante.USAR_NUMPY)
+    informar(nombre, medir(uno_a_uno), medir(en_lote))
+
+
+def rendimiento_ripemd160(cantidad=2000):
+    '''Compara las implementaciones de RIPEMD-160 con entradas del tamaño de las
+    de hash160 y con claves públicas comprimidas y sin comprimir'''
+    print('ripemd160 elegida al importar: {}'.format(ayudante.ripemd160.__name__))
+    for longitud in (32, 33, 65):
+        entradas = [os.urandom(longitud) for _ in range(cantidad)]
+        antes = medir(lambda: [ayudante.ripemd160_python(s) for s in entradas])
+        try:
+            después = medir(lambda: [ayudante.ripemd160_hashlib(s) for s in entradas])
+        except ValueError:
+            print('hashlib no tiene ripemd160: {:.2f} µs por hash en python'.format(
+                antes / cantidad * 1e6))
+            continue
+        informar('ripemd160 python -> hashlib de {} bytes'.format(longitud), antes, después)
+
+
+def rendimiento_evaluar(repeticiones=200):
+    '''Compara verificar una firma p2pkh directamente, como hacía
+    Tx.verificar_input, con ejecutar el script_sig y el script_pubkey'''
+    clave = ClavePrivada(randint(1, N - 1))
+    z = randint(1, N - 1)
+    sec = clave.punto.sec()
+    sig = clave.firmar(z).der() + bytes([1])
+    script = Script([sig, sec]) + script_p2pkh(hash160(sec))
+
+    def directo():
+        return PuntoS256.parsear(sec).verificar(z, Firma.parsear(sig[:-1]))
+
+    informar('verificar p2pkh directamente -> evaluar', medir(directo, repeticiones),
+             medir(lambda: script.evaluar(z), repeticiones))
+    # sin firmas: el coste del propio intérprete
+    aritmética = Script([0x51, 0x52, 0x93, 0x76, 0x93, 0x56, 0x87] * 100 + [0x51])
+    print('  evaluar 701 op codes sin firmas: {:.2f} µs'.format(
+        medir(lambda: aritmética.evaluar(0), repeticiones) * 1e6))
+
+
+def rendimiento_hashear_lote():
+    '''Compara doble_sha256 en serie con hilos y procesos, con entradas
+    pequeñas (cabeceras) y grandes (donde hashlib suelta el GIL)'''
+    print('  núcleos: {}'.format(os.cpu_count()))
+    for nombre, datos in (('cabeceras', [os.urandom(80) for _ in range(100000)]),
+                          ('64 KiB', [os.urandom(65536) for _ in range(500)])):
+        serie = medir(lambda: doble_sha256_lote(datos, 'serie'))
+        informar('doble_sha256 de {} {} con hilos'.format(len(datos), nombre),
+                 serie, medir(lambda: doble_sha256_lote(datos, 'hilos')))
+        informar('doble_sha256 de {} {} con procesos'.format(len(datos), nombre),
+                 serie, medir(lambda: doble_sha256_lote(datos, 'procesos')))
+
+
+if __name__ == '__main__':
+    rendimiento_multiplicación_escalar()
+    rendimiento_tabla_generador()
+    rendimiento_verificar()
+    rendimiento_invertir_lote()
+    rendimiento_glv()
+    rendimiento_campo()
+    rendimiento_derivar()
+    rendimiento_parsear()
+    rendimiento_serializar()
+    rendimiento_script_perezoso()
+    rendimiento_clasificar()
+    rendimiento_merkle()
+    rendimiento_árbol_merkle()
+    rendimiento_bloom()
+    rendimiento_ripemd160()
+    rendimiento_evaluar()
+    rendimiento_hashear_lote()
@@ -1,13 +1,23 @@
 from io import BytesIO
+from operator import is_
 from unittest import TestCase
 
+import copy
+import hashlib
+import pickle
+
 from ayudante import (
+    a_lector,
     codificar_varint,
+    EscritorBytes,
+    decodificar_base58_checksum,
     h160_a_dire_p2pkh,
     h160_a_dire_p2sh,
-    int_a_little_endian,
-    read_varint,
+    hash160,
+    doble_sha256,
+    ripemd160,
 )
+from cce import ClavePrivada, Firma, PuntoS256
 
 
 def script_p2pkh(h160):
@@ -15,10 +25,175 @@ def script_p2pkh(h160):
     return Script([0x76, 0xa9, h160, 0x88, 0xac])
 
 
+OP_PUSHDATA1 = 76
+OP_PUSHDATA2 = 77
+OP_PUSHDATA4 = 78
+# qué hace cada byte de un script al decodificarlo: None si es un op code,
+# 0 si empuja tantos bytes como indica él mismo (1 a 75) o cuántos bytes
+# little-endian siguientes dan la longitud del elemento (OP_PUSHDATA1/2/4)
+BYTES_LONGITUD_PUSH = tuple(
+    0 if 1 <= byte <= 75 else {OP_PUSHDATA1: 1, OP_PUSHDATA2: 2, OP_PUSHDATA4: 4}.get(byte)
+    for byte in range(256))
+# lo que va delante de un elemento de cada longitud menor que 256
+PREFIJOS_PUSH = tuple(bytes([n]) if n <= 75 else bytes([OP_PUSHDATA1, n]) for n in range(256))
+
+
+def prefijo_push(n):
+    '''Devuelve los bytes que van delante de un elemento de longitud n'''
+    if n < 256:
+        return PREFIJOS_PUSH[n]
+    elif n < 0x10000:
+        return bytes([OP_PUSHDATA2]) + n.to_bytes(2, 'little')
+    elif n < 0x100000000:
+        return bytes([OP_PUSHDATA4]) + n.to_bytes(4, 'little')
+    raise ValueError('elemento demasiado largo: {} bytes'.format(n))
+
+
+def decodificar_cosas(bruto):
+    '''Devuelve la lista de cosas (op codes y elementos) del script bruto'''
+    longitud = len(bruto)
+    # inicializa el array de cosas
+    cosas = []
+    # inicializa el número de bytes que hemos leído a 0
+    contador = 0
+    # haz un bucle hasta que leamos la longitud en bytes
+    while contador < longitud:
+        # obtén el byte actual como entero
+        byte_actual = bruto[contador]
+        # aumenta los bytes que hemos leído
+        contador += 1
+        # busca en la tabla qué hace este byte
+        bytes_longitud = BYTES_LONGITUD_PUSH[byte_actual]
+        if bytes_longitud is None:
+            # tenemos un op code: añádelo a la lista de cosas
+            cosas.append(byte_actual)
+            continue
+        if bytes_longitud == 0:
+            # entre 1 y 75: el propio byte es la longitud
+            n = byte_actual
+        else:
+            # OP_PUSHDATA1/2/4: la longitud va en los bytes siguientes
+            n = int.from_bytes(bruto[contador:contador + bytes_longitud], 'little')
+            contador += bytes_longitud
+        # añade los siguientes n bytes como una cosa
+        cosas.append(bytes(bruto[contador:contador + n]))
+        # aumenta el contador en n
+        contador += n
+    return cosas
+
+
+OP_RETURN = 0x6a
+OP_CHECKMULTISIG = 0xae
+# plantillas de los scripts de longitud fija: (tipo, longitud, bytes fijos como
+# (posición, byte), inicio y fin del dato a extraer). Se comparan con los bytes
+# sin decodificar
+PLANTILLAS_SCRIPT = (
+    ('p2pkh', 25, ((0, 0x76), (1, 0xa9), (2, 0x14), (23, 0x88), (24, 0xac)), 3, 23),
+    ('p2sh', 23, ((0, 0xa9), (1, 0x14), (22, 0x87)), 2, 22),
+    ('p2wpkh', 22, ((0, 0x00), (1, 0x14)), 2, 22),
+    ('p2wsh', 34, ((0, 0x00), (1, 0x20)), 2, 34),
+    ('p2tr', 34, ((0, 0x51), (1, 0x20)), 2, 34),
+    ('p2pk', 35, ((0, 0x21), (1, 0x02), (34, 0xac)), 1, 34),
+    ('p2pk', 35, ((0, 0x21), (1, 0x03), (34, 0xac)), 1, 34),
+    ('p2pk', 67, ((0, 0x41), (1, 0x04), (66, 0xac)), 1, 66),
+)
+# (longitud, primer byte, segundo byte) -> (tipo, resto de bytes fijos, inicio, fin):
+# una sola búsqueda descarta casi todos los scripts que no son de una plantilla
+ÍNDICE_PLANTILLAS = {
+    (longitud, fijos[0][1], fijos[1][1]): (tipo, fijos[2:], inicio, fin)
+    for tipo, longitud, fijos, inicio, fin in PLANTILLAS_SCRIPT}
+# longitud del push de cada tamaño de clave pública sec en un multisig
+PUSHES_SEC = {0x21: 33, 0x41: 65}
+
+
+def clasificar_multisig(bruto):
+    '''Devuelve (m, claves públicas) si bruto es OP_m <claves> OP_n OP_CHECKMULTISIG,
+    si no None'''
+    longitud = len(bruto)
+    if longitud < 37 or bruto[-1] != OP_CHECKMULTISIG:
+        return None
+    # OP_1 a OP_16 son 0x51 a 0x60
+    m, n = bruto[0] - 0x50, bruto[-2] - 0x50
+    if not 1 <= m <= n <= 16:
+        return None
+    claves = []
+    contador, fin = 1, longitud - 2
+    # solo se recorren pushes de 33 o 65 bytes: cualquier otra cosa no es multisig
+    while contador < fin:
+        tamaño = PUSHES_SEC.get(bruto[contador])
+        if tamaño is None or contador + 1 + tamaño > fin:
+            return None
+        claves.append(bytes(bruto[contador + 1:contador + 1 + tamaño]))
+        contador += 1 + tamaño
+    if len(claves) != n:
+        return None
+    return m, claves
+
+
+def clasificar_script(bruto):
+    '''Devuelve (tipo, dato) mirando solo la longitud y los bytes fijos del script
+    bruto (sin la longitud delante), o None si no es de un tipo estándar.
+    dato es el hash o la clave pública; para multisig (m, claves) y para
+    op_return los bytes que siguen a OP_RETURN'''
+    longitud = len(bruto)
+    if longitud >= 2:
+        plantilla = ÍNDICE_PLANTILLAS.get((longitud, bruto[0], bruto[1]))
+        if plantilla is not None:
+            tipo, fijos, inicio, fin = plantilla
+            for posición, byte in fijos:
+                if bruto[posición] != byte:
+                    break
+            else:
+                return tipo, bytes(bruto[inicio:fin])
+    if longitud > 0 and bruto[0] == OP_RETURN:
+        return 'op_return', bytes(bruto[1:])
+    multisig = clasificar_multisig(bruto)
+    if multisig is not None:
+        return 'multisig', multisig
+    return None
+
+
 class Script:
 
-    def __init__(self, cosas):
-        self.cosas = cosas
+    def __init__(self, cosas=None, bruto=None):
+        # sin nada es un script vacío
+        if cosas is None and bruto is None:
+            cosas = []
+        # serialización original sin la longitud delante (memoryview del buffer
+        # del que se parseó); las cosas se decodifican la primera vez que se piden
+        self.bruto = bruto
+        self.lista = cosas
+        # las cosas recién decodificadas, para saber si la lista ha cambiado
+        self.originales = None
+
+    def __getstate__(self):
+        # un memoryview no se puede copiar ni serializar con pickle
+        estado = self.__dict__.copy()
+        if estado['bruto'] is not None:
+            estado['bruto'] = bytes(estado['bruto'])
+        return estado
+
+    @property
+    def cosas(self):
+        if self.lista is None:
+            self.lista = decodificar_cosas(self.bruto)
+            self.originales = tuple(self.lista)
+        return self.lista
+
+    @cosas.setter
+    def cosas(self, cosas):
+        # unas cosas nuevas invalidan la serialización original
+        self.lista = cosas
+        self.bruto = None
+
+    def sin_modificar(self):
+        '''Devuelve si bruto sigue siendo la serialización de las cosas'''
+        if self.bruto is None:
+            return False
+        if self.lista is None:
+            return True
+        lista, originales = self.lista, self.originales
+        return len(lista) == len(originales) and all(map(is_, lista, originales))
 
     def __repr__(self):
         res = ''
@@ -31,56 +206,135 @@ class Script:
 
     @classmethod
     def parsear(cls, s):
+        s = a_lector(s)
         # obtén la longitud del campo completo
-        longitud = read_varint(s)
-        # inicializa el array de cosas
-        cosas = []
-        # inicializa el número de bytes que hemos leído a 0
-        contador = 0
-        # haz un bucle hasta que leamos la longitud en bytes
-        while contador < longitud:
-            # obtén el byte actual
-            actual = s.read(1)
-            # aumenta los bytes que hemos leído
-            contador += 1
-            # convierte el byte actual a un entero
-            byte_actual = actual[0]
-            # si el byte actual está entre 1 y 75 ambos incluidos
-            if byte_actual >= 1 and byte_actual <= 75:
-                # tenemos una cosa como n para ser el byte actual
-                n = byte_actual
-                # añade los siguientes n bytes como una cosa
-                cosas.append(s.read(n))
-                # aumenta el contador en n
-                contador += n
-            else:
-                # tenemos un op code. establece el byte actual a op_code
-                op_code = byte_actual
-                # añade el op_code a la lista de cosas
-                cosas.append(op_code)
-        return cls(cosas)
+        longitud = s.read_varint()
+        # guarda el script entero sin copiarlo ni decodificarlo todavía
+        return cls(bruto=s.read_vista(longitud))
 
     def serializar(self):
-        # inicializa lo que enviaremos de vuelta
-        res = b''
+        '''Devuelve la serialización en bytes del script, con su longitud delante'''
+        escritor = EscritorBytes()
+        self.serializar_en(escritor)
+        return escritor.getvalue()
+
+    def serializar_en(self, escritor):
+        '''Escribe el script en el EscritorBytes'''
+        # si no ha cambiado desde que se parseó, se copia tal cual
+        if self.sin_modificar():
+            escritor.write_varint(len(self.bruto))
+            escritor.write(self.bruto)
+            return
+        cosas = self.cosas
+        # la longitud va delante: calcúlala antes de escribir nada
+        total = 0
+        for cosa in cosas:
+            if type(cosa) == int:
+                total += 1
+            else:
+                total += len(prefijo_push(len(cosa))) + len(cosa)
+        escritor.write_varint(total)
+        self.escribir_cosas(escritor)
+
+    def escribir_cosas(self, escritor):
+        '''Escribe las cosas en el EscritorBytes, sin la longitud delante'''
         # ve a través de cada cosa
         for cosa in self.cosas:
             # si la cosa es un entero, es un op code
             if type(cosa) == int:
-                # convierte la cosa en un único byte entero usando int_a_little_endian
-                res += int_a_little_endian(cosa, 1)
+                # escribe el op code como un único byte
+                escritor.write_u8(cosa)
             else:
-                # en otro caso, esto es un elemento
-                # obtén la longitud en bytes
-                longitud = len(cosa)
-                # convierte la longitud en un único byte entero usando int_a_little_endian
-                prefijo = int_a_little_endian(longitud, 1)
-                # añade al resultado tanto la longitud como la cosa
-                res += prefijo + cosa
-        # obtén la longitud de todo
-        total = len(res)
-        # codificar_varint la longitud total de res y anteponlo
-        return codificar_varint(total) + res
+                # en otro caso, esto es un elemento: escribe su longitud
+                # (con OP_PUSHDATA1/2/4 si no cabe en un byte hasta 75)
+                escritor.write(prefijo_push(len(cosa)))
+                # y después el elemento
+                escritor.write(cosa)
+
+    def cuerpo(self):
+        '''Devuelve los bytes del script sin la longitud delante'''
+        if self.sin_modificar():
+            return self.bruto
+        escritor = EscritorBytes()
+        self.escribir_cosas(escritor)
+        return escritor.getvalue()
+
+    def clasificar(self):
+        '''Devuelve (tipo, dato) como clasificar_script, o None'''
+        # sin decodificar no hace falta comprobar si se ha modificado
+        if self.lista is None:
+            return clasificar_script(self.bruto)
+        return clasificar_script(self.cuerpo())
+
+    def __add__(self, otro):
+        return Script(self.cosas + otro.cosas)
+
+    def ejecutar(self, z, pila=None):
+        '''Ejecuta el script empezando con una copia de pila (vacía si es None).
+        Devuelve la pila final, o None si el script falla o deja un OP_IF abierto.
+        z es el sig_hash o una función que lo da a partir del tipo de hash'''
+        pila = [] if pila is None else list(pila)
+        altpila = []
+        # una entrada por cada OP_IF abierto: si se ejecuta su rama actual
+        condiciones = []
+        # cuántas de esas ramas no se ejecutan: solo se ejecuta si es 0
+        falsos = 0
+        operaciones = OPERACIONES
+        try:
+            for cosa in self.cosas:
+                if type(cosa) is not int:
+                    # el tamaño se comprueba también en las ramas que no se ejecutan
+                    if len(cosa) > MÁXIMO_ELEMENTO:
+                        return None
+                    # un elemento: se apila si se está ejecutando
+                    if falsos:
+                        continue
+                    pila.append(cosa)
+                elif cosa in SIEMPRE_INVÁLIDOS:
+                    return None
+                elif cosa in CONTROL_FLUJO:
+                    # OP_IF y compañía se procesan aunque no se esté ejecutando
+                    if cosa == OP_IF or cosa == OP_NOTIF:
+                        valor = False
+                        if not falsos:
+                            valor = es_verdadero(pila.pop()) != (cosa == OP_NOTIF)
+                        condiciones.append(valor)
+                        if not valor:
+                            falsos += 1
+                    elif not condiciones:
+                        # OP_ELSE u OP_ENDIF sin OP_IF
+                        return None
+                    elif cosa == OP_ELSE:
+                        valor = condiciones[-1]
+                        condiciones[-1] = not valor
+                        falsos += 1 if valor else -1
+                    elif not condiciones.pop():
+                        falsos -= 1
+                    continue
+                elif falsos:
+                    continue
+                else:
+                    operación = operaciones[cosa]
+                    # sale en cuanto una operación falla
+                    if operación is None or not operación(pila, altpila, z):
+                        return None
+                if len(pila) + len(altpila) > MÁXIMO_PILA:
+                    return None
+        except (IndexError, ValueError):
+            # faltan elementos en la pila o un número no es válido
+            return None
+        # los OP_IF no pueden cruzar de un script a otro
+        if condiciones:
+            return None
+        return pila
+
+    def evaluar(self, z, pila=None):
+        '''Ejecuta el script como ejecutar y devuelve si termina con un elemento
+        verdadero arriba de la pila'''
+        pila = self.ejecutar(z, pila)
+        if not pila:
+            return False
+        return es_verdadero(pila[-1])
 
     def firma(self):
         '''devuelve el elemento firma asumiendo script sig de p2pkh'''
@@ -91,18 +345,502 @@ class Script:
         return self.cosas[1]
 
     def dire(self, testnet=False):
-        '''Devuelve la dirección correspondiente al script'''
-        # HACK: cuenta cuántos elementos hay para determinar de qué tipo es
-        if len(self.cosas) == 5:  # p2pkh
-            # hash160 es el tercer elemento
-            h160 = self.cosas[2]
+        '''Devuelve la dirección correspondiente al script, o None si no es
+        p2pkh ni p2sh'''
+        tipo_h160 = self.tipo_h160()
+        if tipo_h160 is None:
+            return None
+        tipo, h160 = tipo_h160
+        if tipo == 'p2pkh':
             # convierte a dire p2pkh usando h160_a_dire_p2pkh (recuerda testnet)
             return h160_a_dire_p2pkh(h160, testnet)
-        elif len(self.cosas) == 3:  # p2sh
-            # hash160 es el segundo elemento
-            h160 = self.cosas[1]
-            # convierte a dire p2sh usando h160_a_dire_p2sh (recuerda testnet)
-            return h160_a_dire_p2sh(h160, testnet)
+        # convierte a dire p2sh usando h160_a_dire_p2sh (recuerda testnet)
+        return h160_a_dire_p2sh(h160, testnet)
+
+    def tipo_h160(self):
+        '''Devuelve (tipo, h160) si el script es p2pkh o p2sh, si no None'''
+        clase = self.clasificar()
+        if clase is None or clase[0] not in ('p2pkh', 'p2sh'):
+            return None
+        return clase
+
+
+# tipo de script y si es testnet para cada prefijo de dirección base58
+PREFIJOS_DIRECCIÓN = {
+    0x00: ('p2pkh', False),
+    0x6f: ('p2pkh', True),
+    0x05: ('p2sh', False),
+    0xc4: ('p2sh', True),
+}
+
+
+class LibretaDirecciones:
+    '''Direcciones vigiladas indexadas por h160, para comprobar scripts
+    sin pasar nada a base58'''
+
+    def __init__(self, dires=()):
+        # h160 -> {tipo: dirección}
+        self.vigiladas = {}
+        for dire in dires:
+            self.añadir(dire)
+
+    def __len__(self):
+        return sum(len(tipos) for tipos in self.vigiladas.values())
+
+    def añadir(self, dire):
+        '''Decodifica la dirección una sola vez y la guarda por su h160'''
+        combinado = decodificar_base58_checksum(dire)
+        if len(combinado) != 21 or combinado[0] not in PREFIJOS_DIRECCIÓN:
+            raise ValueError('dirección no soportada: {}'.format(dire))
+        tipo, _ = PREFIJOS_DIRECCIÓN[combinado[0]]
+        self.vigiladas.setdefault(combinado[1:], {})[tipo] = dire
+
+    def buscar(self, script_pubkey):
+        '''Devuelve la dirección vigilada del script_pubkey o None'''
+        tipo_h160 = script_pubkey.tipo_h160()
+        if tipo_h160 is None:
+            return None
+        tipo, h160 = tipo_h160
+        tipos = self.vigiladas.get(h160)
+        if tipos is None:
+            return None
+        return tipos.get(tipo)
+
+    def __contains__(self, script_pubkey):
+        return self.buscar(script_pubkey) is not None
+
+    def buscar_outputs(self, tx_outs):
+        '''Genera (índice, tx_out, dirección) para cada output vigilado'''
+        for índice, tx_out in enumerate(tx_outs):
+            dire = self.buscar(tx_out.script_pubkey)
+            if dire is not None:
+                yield índice, tx_out, dire
+
+
+# límites de la máquina de script, como en Bitcoin Core
+MÁXIMO_PILA = 1000
+MÁXIMO_ELEMENTO = 520
+MÁXIMO_CLAVES_MULTISIG = 20
+OP_IF = 0x63
+OP_NOTIF = 0x64
+OP_ELSE = 0x67
+OP_ENDIF = 0x68
+CONTROL_FLUJO = frozenset((OP_IF, OP_NOTIF, OP_ELSE, OP_ENDIF))
+# op codes que invalidan el script aunque estén en una rama que no se ejecuta:
+# OP_VERIF, OP_VERNOTIF y los desactivados (OP_CAT, OP_SUBSTR, OP_LEFT,
+# OP_RIGHT, OP_INVERT, OP_AND, OP_OR, OP_XOR, OP_2MUL, OP_2DIV, OP_MUL,
+# OP_DIV, OP_MOD, OP_LSHIFT y OP_RSHIFT)
+SIEMPRE_INVÁLIDOS = frozenset((
+    0x65, 0x66, 0x7e, 0x7f, 0x80, 0x81, 0x83, 0x84, 0x85, 0x86,
+    0x8d, 0x8e, 0x95, 0x96, 0x97, 0x98, 0x99))
+
+
+def codificar_num(num):
+    '''Codifica un entero como elemento de la pila (little-endian con signo)'''
+    if num == 0:
+        return b''
+    abs_num = abs(num)
+    negativo = num < 0
+    res = bytearray()
+    while abs_num:
+        res.append(abs_num & 0xff)
+        abs_num >>= 8
+    # si el bit más alto está puesto, hace falta un byte más para el signo
+    if res[-1] & 0x80:
+        res.append(0x80 if negativo else 0)
+    elif negativo:
+        res[-1] |= 0x80
+    return bytes(res)
+
+
+def decodificar_num(elemento):
+    '''Decodifica un elemento de la pila como entero. Los operandos de la
+    aritmética tienen como mucho 4 bytes'''
+    if len(elemento) > 4:
+        raise ValueError('número demasiado largo: {} bytes'.format(len(elemento)))
+    if not elemento:
+        return 0
+    num = int.from_bytes(elemento, 'little')
+    # el bit más alto del último byte es el signo
+    signo = 0x80 << (8 * (len(elemento) - 1))
+    if num & signo:
+        return -(num ^ signo)
+    return num
+
+
+def es_verdadero(elemento):
+    '''Devuelve si el elemento cuenta como verdadero: algún byte distinto de 0,
+    salvo el cero negativo (solo el bit de signo del último byte)'''
+    for i, byte in enumerate(elemento):
+        if byte:
+            return i != len(elemento) - 1 or byte != 0x80
+    return False
+
+
+# elementos con los que se apilan los valores de verdad
+VERDADERO = codificar_num(1)
+FALSO = codificar_num(0)
+
+
+def op_constante(num):
+    '''Devuelve la operación que apila num (OP_0, OP_1NEGATE y OP_1 a OP_16)'''
+    elemento = codificar_num(num)
+
+    def op(pila, altpila, z):
+        pila.append(elemento)
+        return True
+    return op
+
+
+def op_nop(pila, altpila, z):
+    return True
+
+
+def op_verify(pila, altpila, z):
+    return es_verdadero(pila.pop())
+
+
+def op_return(pila, altpila, z):
+    return False
+
+
+def op_toaltstack(pila, altpila, z):
+    altpila.append(pila.pop())
+    return True
+
+
+def op_fromaltstack(pila, altpila, z):
+    pila.append(altpila.pop())
+    return True
+
+
+def op_2drop(pila, altpila, z):
+    pila.pop()
+    pila.pop()
+    return True
+
+
+def op_2dup(pila, altpila, z):
+    if len(pila) < 2:
+        return False
+    pila.extend(pila[-2:])
+    return True
+
+
+def op_3dup(pila, altpila, z):
+    if len(pila) < 3:
+        return False
+    pila.extend(pila[-3:])
+    return True
+
+
+def op_2over(pila, altpila, z):
+    if len(pila) < 4:
+        return False
+    pila.extend(pila[-4:-2])
+    return True
+
+
+def op_2rot(pila, altpila, z):
+    if len(pila) < 6:
+        return False
+    pila.extend(pila[-6:-4])
+    del pila[-8:-6]
+    return True
+
+
+def op_2swap(pila, altpila, z):
+    if len(pila) < 4:
+        return False
+    pila[-4:] = pila[-2:] + pila[-4:-2]
+    return True
+
+
+def op_ifdup(pila, altpila, z):
+    if es_verdadero(pila[-1]):
+        pila.append(pila[-1])
+    return True
+
+
+def op_depth(pila, altpila, z):
+    pila.append(codificar_num(len(pila)))
+    return True
+
+
+def op_drop(pila, altpila, z):
+    pila.pop()
+    return True
+
+
+def op_dup(pila, altpila, z):
+    pila.append(pila[-1])
+    return True
+
+
+def op_nip(pila, altpila, z):
+    del pila[-2]
+    return True
+
+
+def op_over(pila, altpila, z):
+    pila.append(pila[-2])
+    return True
+
+
+def op_pick(pila, altpila, z):
+    n = decodificar_num(pila.pop())
+    if n < 0:
+        return False
+    pila.append(pila[-1 - n])
+    return True
+
+
+def op_roll(pila, altpila, z):
+    n = decodificar_num(pila.pop())
+    if n < 0:
+        return False
+    pila.append(pila.pop(-1 - n))
+    return True
+
+
+def op_rot(pila, altpila, z):
+    pila.append(pila.pop(-3))
+    return True
+
+
+def op_swap(pila, altpila, z):
+    pila.append(pila.pop(-2))
+    return True
+
+
+def op_tuck(pila, altpila, z):
+    if len(pila) < 2:
+        return False
+    pila.insert(-2, pila[-1])
+    return True
+
+
+def op_size(pila, altpila, z):
+    pila.append(codificar_num(len(pila[-1])))
+    return True
+
+
+def op_equal(pila, altpila, z):
+    pila.append(VERDADERO if pila.pop() == pila.pop() else FALSO)
+    return True
+
+
+def op_equalverify(pila, altpila, z):
+    return pila.pop() == pila.pop()
+
+
+def op_unaria(función):
+    '''Devuelve la operación que cambia el número de arriba por función(número)'''
+    def op(pila, altpila, z):
+        pila.append(codificar_num(función(decodificar_num(pila.pop()))))
+        return True
+    return op
+
+
+def op_binaria(función):
+    '''Devuelve la operación que cambia los dos números de arriba a, b por
+    función(a, b)'''
+    def op(pila, altpila, z):
+        b = decodificar_num(pila.pop())
+        a = decodificar_num(pila.pop())
+        pila.append(codificar_num(función(a, b)))
+        return True
+    return op
+
+
+def op_numequalverify(pila, altpila, z):
+    return decodificar_num(pila.pop()) == decodificar_num(pila.pop())
+
+
+def op_within(pila, altpila, z):
+    máximo = decodificar_num(pila.pop())
+    mínimo = decodificar_num(pila.pop())
+    x = decodificar_num(pila.pop())
+    pila.append(VERDADERO if mínimo <= x < máximo else FALSO)
+    return True
+
+
+def op_hash(función):
+    '''Devuelve la operación que cambia el elemento de arriba por su hash'''
+    def op(pila, altpila, z):
+        pila.append(función(pila.pop()))
+        return True
+    return op
+
+
+def verificar_firma(sec, firma, z):
+    '''Devuelve si firma (DER seguida del tipo de hash) es válida para la clave
+    sec. z es el sig_hash o una función que lo da a partir del tipo de hash'''
+    if not firma:
+        return False
+    if callable(z):
+        z = z(firma[-1])
+    try:
+        punto = PuntoS256.parsear(sec)
+        fir = Firma.parsear(firma[:-1])
+    except (IndexError, RuntimeError, ValueError):
+        # una clave o una firma mal codificadas no validan, pero no abortan
+        return False
+    return punto.verificar(z, fir)
+
+
+def op_checksig(pila, altpila, z):
+    sec = pila.pop()
+    firma = pila.pop()
+    pila.append(VERDADERO if verificar_firma(sec, firma, z) else FALSO)
+    return True
+
+
+def op_checksigverify(pila, altpila, z):
+    sec = pila.pop()
+    firma = pila.pop()
+    return verificar_firma(sec, firma, z)
+
+
+def op_checkmultisig(pila, altpila, z):
+    n = decodificar_num(pila.pop())
+    if not 0 <= n <= MÁXIMO_CLAVES_MULTISIG:
+        return False
+    claves = [pila.pop() for _ in range(n)][::-1]
+    m = decodificar_num(pila.pop())
+    if not 0 <= m <= n:
+        return False
+    firmas = [pila.pop() for _ in range(m)][::-1]
+    # OP_CHECKMULTISIG saca un elemento de más
+    pila.pop()
+    # las firmas van en el mismo orden que sus claves: cada firma se prueba con
+    # las claves que siguen a la de la anterior, y se termina en cuanto no
+    # quedan claves suficientes para las firmas que faltan
+    i_clave = 0
+    for i_firma, firma in enumerate(firmas):
+        while True:
+            if m - i_firma > n - i_clave:
+                pila.append(FALSO)
+                return True
+            i_clave += 1
+            if verificar_firma(claves[i_clave - 1], firma, z):
+                break
+    pila.append(VERDADERO)
+    return True
+
+
+def op_checkmultisigverify(pila, altpila, z):
+    return op_checkmultisig(pila, altpila, z) and es_verdadero(pila.pop())
+
+
+# tabla de operaciones por op code; None para los que no se pueden ejecutar.
+# OP_IF, OP_NOTIF, OP_ELSE y OP_ENDIF los trata Script.evaluar directamente
+OPERACIONES = [None] * 256
+OPERACIONES[0x00] = op_constante(0)
+OPERACIONES[0x4f] = op_constante(-1)
+for op_code in range(0x51, 0x61):
+    OPERACIONES[op_code] = op_constante(op_code - 0x50)
+# OP_NOP, OP_NOP1 y OP_NOP4 a OP_NOP10; OP_CHECKLOCKTIMEVERIFY (0xb1) y
+# OP_CHECKSEQUENCEVERIFY (0xb2) necesitan el contexto de la tx: como NOP
+for op_code in (0x61, *range(0xb0, 0xba)):
+    OPERACIONES[op_code] = op_nop
+OPERACIONES[0x69] = op_verify
+OPERACIONES[0x6a] = op_return
+OPERACIONES[0x6b] = op_toaltstack
+OPERACIONES[0x6c] = op_fromaltstack
+OPERACIONES[0x6d] = op_2drop
+OPERACIONES[0x6e] = op_2dup
+OPERACIONES[0x6f] = op_3dup
+OPERACIONES[0x70] = op_2over
+OPERACIONES[0x71] = op_2rot
+OPERACIONES[0x72] = op_2swap
+OPERACIONES[0x73] = op_ifdup
+OPERACIONES[0x74] = op_depth
+OPERACIONES[0x75] = op_drop
+OPERACIONES[0x76] = op_dup
+OPERACIONES[0x77] = op_nip
+OPERACIONES[0x78] = op_over
+OPERACIONES[0x79] = op_pick
+OPERACIONES[0x7a] = op_roll
+OPERACIONES[0x7b] = op_rot
+OPERACIONES[0x7c] = op_swap
+OPERACIONES[0x7d] = op_tuck
+OPERACIONES[0x82] = op_size
+OPERACIONES[0x87] = op_equal
+OPERACIONES[0x88] = op_equalverify
+OPERACIONES[0x8b] = op_unaria(lambda a: a + 1)
+OPERACIONES[0x8c] = op_unaria(lambda a: a - 1)
+OPERACIONES[0x8f] = op_unaria(lambda a: -a)
+OPERACIONES[0x90] = op_unaria(abs)
+OPERACIONES[0x91] = op_unaria(lambda a: int(a == 0))
+OPERACIONES[0x92] = op_unaria(lambda a: int(a != 0))
+OPERACIONES[0x93] = op_binaria(lambda a, b: a + b)
+OPERACIONES[0x94] = op_binaria(lambda a, b: a - b)
+OPERACIONES[0x9a] = op_binaria(lambda a, b: int(a != 0 and b != 0))
+OPERACIONES[0x9b] = op_binaria(lambda a, b: int(a != 0 or b != 0))
+OPERACIONES[0x9c] = op_binaria(lambda a, b: int(a == b))
+OPERACIONES[0x9d] = op_numequalverify
+OPERACIONES[0x9e] = op_binaria(lambda a, b: int(a != b))
+OPERACIONES[0x9f] = op_binaria(lambda a, b: int(a < b))
+OPERACIONES[0xa0] = op_binaria(lambda a, b: int(a > b))
+OPERACIONES[0xa1] = op_binaria(lambda a, b: int(a <= b))
+OPERACIONES[0xa2] = op_binaria(lambda a, b: int(a >= b))
+OPERACIONES[0xa3] = op_binaria(min)
+OPERACIONES[0xa4] = op_binaria(max)
+OPERACIONES[0xa5] = op_within
+OPERACIONES[0xa6] = op_hash(ripemd160)
+OPERACIONES[0xa7] = op_hash(lambda s: hashlib.sha1(s).digest())
+OPERACIONES[0xa8] = op_hash(lambda s: hashlib.sha256(s).digest())
+OPERACIONES[0xa9] = op_hash(hash160)
+OPERACIONES[0xaa] = op_hash(doble_sha256)
+# sin OP_CODESEPARATOR (0xab) el sig_hash siempre usa el script_pubkey entero
+OPERACIONES[0xab] = op_nop
+OPERACIONES[0xac] = op_checksig
+OPERACIONES[0xad] = op_checksigverify
+OPERACIONES[0xae] = op_checkmultisig
+OPERACIONES[0xaf] = op_checkmultisigverify
+
+
+def es_solo_pushes(cosas):
+    '''Devuelve si las cosas son solo elementos y op codes que apilan
+    constantes (hasta OP_16)'''
+    for cosa in cosas:
+        if type(cosa) == int and cosa > 0x60:
+            return False
+    return True
+
+
+def es_programa_testigo(bruto):
+    '''Devuelve si el script bruto es un programa de testigo (segwit): OP_0 a
+    OP_16 seguido de un único push de 2 a 40 bytes, como p2wpkh, p2wsh o p2tr'''
+    return 4 <= len(bruto) <= 42 and (bruto[0] == 0 or 0x51 <= bruto[0] <= 0x60) \
+        and bruto[1] + 2 == len(bruto)
+
+
+def evaluar_gasto(script_sig, script_pubkey, z):
+    '''Ejecuta el script_sig y después el script_pubkey sobre la pila que deja,
+    como scripts separados. Si el script_pubkey es p2sh aplica BIP16: el
+    script_sig tiene que ser solo pushes y el último elemento que apila (el
+    redeem script) se ejecuta después con el resto. z es como en Script.evaluar.
+    Los testigos no se validan: los programas de testigo, directos o dentro de
+    un p2sh, nunca dan una firma válida'''
+    if es_programa_testigo(script_pubkey.cuerpo()):
+        return False
+    clase = script_pubkey.clasificar()
+    es_p2sh = clase is not None and clase[0] == 'p2sh'
+    if es_p2sh and not es_solo_pushes(script_sig.cosas):
+        return False
+    pila = script_sig.ejecutar(z)
+    if pila is None or not script_pubkey.evaluar(z, pila):
+        return False
+    if not es_p2sh:
+        return True
+    # el script_pubkey solo comprueba el hash del redeem script: ahora hay que
+    # ejecutarlo con lo que el script_sig deja debajo
+    if es_programa_testigo(pila[-1]):
+        return False
+    redeem_script = Script(bruto=pila[-1])
+    return redeem_script.evaluar(z, pila[:-1])
 
 
 class PruebaScript(TestCase):
@@ -121,6 +859,92 @@ class PruebaScript(TestCase):
         script = Script.parsear(script_pubkey)
         self.assertEqual(script.serializar().hex(), want)
 
+    def prueba_perezoso(self):
+        bruto = bytes.fromhex('1976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac')
+        script = Script.parsear(bruto)
+        # no se copia ni se decodifica nada al parsear
+        self.assertIs(script.bruto.obj, bruto)
+        self.assertIsNone(script.lista)
+        self.assertEqual(script.serializar(), bruto)
+        self.assertEqual(script.cosas[2].hex(), 'bc3b654dca7e56b04dca18f2566cdaf02e8d9ada')
+        self.assertTrue(script.sin_modificar())
+        self.assertEqual(script.serializar(), bruto)
+        # cambiar la lista o reemplazarla hace que se vuelva a serializar
+        script.cosas[2] = bytes(20)
+        self.assertFalse(script.sin_modificar())
+        self.assertEqual(script.serializar().hex(), '1976a914{}88ac'.format('00' * 20))
+        script = Script.parsear(bruto)
+        script.cosas = [0x6a]
+        self.assertIsNone(script.bruto)
+        self.assertEqual(script.serializar(), bytes([1, 0x6a]))
+
+    def prueba_copiar(self):
+        bruto = bytes.fromhex('1976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac')
+        for decodificar in (False, True):
+            script = Script.parsear(bytearray(bruto) + b'resto')
+            if decodificar:
+                script.cosas
+            for copia in (copy.deepcopy(script), pickle.loads(pickle.dumps(script))):
+                self.assertEqual(type(copia.bruto), bytes)
+                self.assertTrue(copia.sin_modificar())
+                self.assertEqual(copia.serializar(), bruto)
+                self.assertEqual(copia.clasificar()[0], 'p2pkh')
+        self.assertEqual(Script().cosas, [])
+        self.assertEqual(Script().serializar(), b'\x00')
+
+    def prueba_pushdata(self):
+        for n, prefijo in ((75, '4b'), (76, '4c4c'), (255, '4cff'), (256, '4d0001'),
+                           (520, '4d0802'), (0x10000, '4e00000100')):
+            elemento = bytes([7]) * n
+            cuerpo = bytes.fromhex('00' + prefijo) + elemento + bytes([0xae])
+            bruto = codificar_varint(len(cuerpo)) + cuerpo
+            script = Script.parsear(bruto)
+            self.assertEqual(script.cosas, [0, elemento, 0xae])
+            # al reconstruirlo desde las cosas sale igual
+            self.assertEqual(Script([0, elemento, 0xae]).serializar(), bruto)
+        # un push no mínimo se conserva si el script no se modifica
+        bruto = bytes.fromhex('044c02abcd')
+        script = Script.parsear(bruto)
+        self.assertEqual(script.cosas, [bytes.fromhex('abcd')])
+        self.assertEqual(script.serializar(), bruto)
+        self.assertEqual(Script(script.cosas[:]).serializar().hex(), '0302abcd')
+        # un push que se sale del script da el trozo que haya
+        self.assertEqual(Script.parsear(bytes.fromhex('034d0500')).cosas, [b''])
+
+    def prueba_clasificar(self):
+        h20, h32 = bytes(range(20)), bytes(range(32))
+        sec33, sec65 = bytes([2]) + h32, bytes([4]) + h32 + h32
+        casos = (
+            ('76a914{}88ac'.format(h20.hex()), ('p2pkh', h20)),
+            ('a914{}87'.format(h20.hex()), ('p2sh', h20)),
+            ('0014{}'.format(h20.hex()), ('p2wpkh', h20)),
+            ('0020{}'.format(h32.hex()), ('p2wsh', h32)),
+            ('5120{}'.format(h32.hex()), ('p2tr', h32)),
+            ('21{}ac'.format(sec33.hex()), ('p2pk', sec33)),
+            ('41{}ac'.format(sec65.hex()), ('p2pk', sec65)),
+            ('6a0568656c6c6f', ('op_return', bytes.fromhex('0568656c6c6f'))),
+            ('6a', ('op_return', b'')),
+            ('5121{}41{}52ae'.format(sec33.hex(), sec65.hex()), ('multisig', (1, [sec33, sec65]))),
+            # 3 claves anunciadas pero solo hay 2
+            ('5121{}41{}53ae'.format(sec33.hex(), sec65.hex()), None),
+            # m mayor que n
+            ('5221{}51ae'.format(sec33.hex()), None),
+            # clave de 33 bytes con una cabecera imposible
+            ('21{}ac'.format((bytes([5]) + h32).hex()), None),
+            ('76a914{}88ad'.format(h20.hex()), None),
+            ('', None),
+        )
+        for cuerpo, esperado in casos:
+            bruto = bytes.fromhex(cuerpo)
+            self.assertEqual(clasificar_script(bruto), esperado)
+            script = Script.parsear(codificar_varint(len(bruto)) + bruto)
+            self.assertEqual(script.clasificar(), esperado)
+            # igual si el script se ha construido a partir de sus cosas
+            self.assertEqual(Script(decodificar_cosas(bruto)).clasificar(), esperado)
+        script = Script.parsear(bytes.fromhex('160014{}'.format(h20.hex())))
+        self.assertIsNone(script.dire())
+        self.assertIsNone(script.tipo_h160())
+
     def prueba_p2pkh(self):
         script_pubkey_bruto = bytes.fromhex('1976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac')
         script_pubkey = Script.parsear(BytesIO(script_pubkey_bruto))
@@ -156,6 +980,170 @@ class PruebaScript(TestCase):
         self.assertEqual(script_pubkey.dire(testnet=True), want)
 
 
+class PruebaLibretaDirecciones(TestCase):
+
+    def prueba_buscar(self):
+        p2pkh = Script.parsear(BytesIO(bytes.fromhex('1976a914338c84849423992471bffb1a54a8d9b1d69dc28a88ac')))
+        p2sh = Script.parsear(BytesIO(bytes.fromhex('17a91474d691da1574e6b3c192ecfb52cc8984ee7b6c5687')))
+        # mismo h160 que p2sh pero como p2pkh
+        otro = script_p2pkh(bytes.fromhex('74d691da1574e6b3c192ecfb52cc8984ee7b6c56'))
+        libreta = LibretaDirecciones(['mkDX6B619yTLsLHVp23QanB9ehT5bcf89D', '3CLoMMyuoDQTPRD3XYZtCvgvkadrAdvdXh'])
+        self.assertEqual(len(libreta), 2)
+        self.assertEqual(libreta.buscar(p2pkh), 'mkDX6B619yTLsLHVp23QanB9ehT5bcf89D')
+        self.assertEqual(libreta.buscar(p2sh), '3CLoMMyuoDQTPRD3XYZtCvgvkadrAdvdXh')
+        self.assertIn(p2sh, libreta)
+        self.assertNotIn(otro, libreta)
+        self.assertNotIn(Script([0x6a, b'hola']), libreta)
+        with self.assertRaises(ValueError):
+            libreta.añadir('KwDiBf89QgGbjEhKnhXJuH7LrciVrZi3qYjgd9M7rFU73sVHnoWn')
+
+    def prueba_buscar_outputs(self):
+        from tx import TxOut
+        libreta = LibretaDirecciones(['15hZo812Lx266Dot6T52krxpnhrNiaqHya'])
+        h160 = bytes.fromhex('338c84849423992471bffb1a54a8d9b1d69dc28a')
+        tx_outs = [
+            TxOut(1000, script_p2pkh(bytes(20))),
+            TxOut(2000, script_p2pkh(h160)),
+        ]
+        res = list(libreta.buscar_outputs(tx_outs))
+        self.assertEqual(res, [(1, tx_outs[1], '15hZo812Lx266Dot6T52krxpnhrNiaqHya')])
+
+
+class PruebaEvaluar(TestCase):
+
+    def prueba_p2pk(self):
+        z = 0x7c076ff316692a3d7eb3c3bb0f8b1488cf72e1afcd929e29307032997a838a3d
+        sec = bytes.fromhex('04887387e452b8eacc4acfde10d9aaf7f6d9a0f975aabb10d006e4da568744d06c61de6d95231cd89026e286df3b6ae4a894a3378e393e93a0f45b666329a0ae34')
+        sig = bytes.fromhex('3045022000eff69ef2b1bd93a66ed5219add4fb51e11a840f404876325a1e8ffe0529a2c022100c7207fee197d27c618aea621406f6bf5ef6fca38681d82b2f06fddbdce6feab601')
+        script_pubkey = Script([sec, 0xac])
+        script_sig = Script([sig])
+        self.assertTrue((script_sig + script_pubkey).evaluar(z))
+        self.assertFalse((script_sig + script_pubkey).evaluar(z + 1))
+        # una firma mal codificada no valida
+        self.assertFalse((Script([sig[1:]]) + script_pubkey).evaluar(z))
+        # también con un script_pubkey parseado que aún no se ha decodificado
+        script_pubkey = Script.parsear(script_pubkey.serializar())
+        self.assertTrue((script_sig + script_pubkey).evaluar(z))
+
+    def prueba_p2pkh(self):
+        clave = ClavePrivada(8675309)
+        sec = clave.punto.sec()
+        zs = {1: 0x1234, 2: 0x5678}
+        sig = clave.firmar(zs[1]).der() + bytes([1])
+        script_pubkey = script_p2pkh(hash160(sec))
+        self.assertTrue((Script([sig, sec]) + script_pubkey).evaluar(zs.get))
+        # el tipo de hash va al final de la firma y decide qué z se usa
+        self.assertFalse((Script([sig[:-1] + bytes([2]), sec]) + script_pubkey).evaluar(zs.get))
+        otra = ClavePrivada(8675310).punto.sec()
+        self.assertFalse((Script([sig, otra]) + script_pubkey).evaluar(zs.get))
+
+    def prueba_multisig(self):
+        z = 0xabcdef
+        claves = [ClavePrivada(secreto) for secreto in (11, 22, 33)]
+        secs = [clave.punto.sec() for clave in claves]
+        firmas = [clave.firmar(z).der() + bytes([1]) for clave in claves]
+        script_pubkey = Script([0x52] + secs + [0x53, 0xae])
+        for i, j in ((0, 1), (0, 2), (1, 2)):
+            script_sig = Script([0, firmas[i], firmas[j]])
+            self.assertTrue((script_sig + script_pubkey).evaluar(z))
+        # las firmas tienen que ir en el orden de las claves
+        self.assertFalse((Script([0, firmas[2], firmas[0]]) + script_pubkey).evaluar(z))
+        self.assertFalse((Script([0, firmas[0], firmas[0]]) + script_pubkey).evaluar(z))
+        # falta el elemento de más que saca OP_CHECKMULTISIG
+        self.assertFalse((Script([firmas[0], firmas[1]]) + script_pubkey).evaluar(z))
+
+    def prueba_p2sh(self):
+        z = 0xabcdef
+        claves = [ClavePrivada(secreto) for secreto in (11, 22)]
+        firmas = [clave.firmar(z).der() + bytes([1]) for clave in claves]
+        redeem_script = Script([0x52] + [clave.punto.sec() for clave in claves] + [0x52, 0xae])
+        cuerpo = redeem_script.serializar()[1:]
+        script_pubkey = Script([0xa9, hash160(cuerpo), 0x87])
+
+        def z_prohibida(tipo_hash):
+            raise AssertionError('no hay firmas que verificar')
+
+        # sin firmas el redeem script no se cumple, aunque el hash coincida
+        self.assertTrue((Script([cuerpo]) + script_pubkey).evaluar(z_prohibida))
+        self.assertFalse(evaluar_gasto(Script([cuerpo]), script_pubkey, z_prohibida))
+        self.assertTrue(evaluar_gasto(Script([0, firmas[0], firmas[1], cuerpo]), script_pubkey, z))
+        self.assertFalse(evaluar_gasto(Script([0, firmas[1], firmas[0], cuerpo]), script_pubkey, z))
+        # el script_sig tiene que ser solo pushes
+        self.assertFalse(evaluar_gasto(Script([0, firmas[0], firmas[1], 0x61, cuerpo]), script_pubkey, z))
+        self.assertFalse(evaluar_gasto(Script([]), script_pubkey, z))
+        # un redeem script con otro hash
+        self.assertFalse(evaluar_gasto(Script([0, firmas[0], firmas[1], cuerpo + b'\x00']), script_pubkey, z))
+        # los scripts que no son p2sh se ejecutan sin más
+        sec = claves[0].punto.sec()
+        self.assertTrue(evaluar_gasto(Script([firmas[0], sec]), script_p2pkh(hash160(sec)), z))
+
+    def prueba_scripts_separados(self):
+        # un OP_IF del script_sig no se puede cerrar en el script_pubkey
+        self.assertTrue((Script([0x00, 0x63]) + Script([0x68, 0x51])).evaluar(0))
+        self.assertFalse(evaluar_gasto(Script([0x00, 0x63]), Script([0x68, 0x51]), 0))
+        self.assertFalse(evaluar_gasto(Script([0x51]), Script([0x63, 0x51]), 0))
+        # la pila sí pasa de uno a otro, y el script_sig puede dejar falso arriba
+        self.assertTrue(evaluar_gasto(Script([0x52, 0x00]), Script([0x75, 0x52, 0x87]), 0))
+        self.assertEqual(Script([0x52]).ejecutar(0, [b'\x01']), [b'\x01', b'\x02'])
+        self.assertTrue(Script([0x87]).evaluar(0, [b'\x01', b'\x01']))
+
+    def prueba_testigo(self):
+        h20, h32 = bytes(range(20)), bytes(range(32))
+        # sin testigos que validar, gastar segwit o taproot nunca es válido
+        for script_pubkey in (Script([0, h20]), Script([0, h32]), Script([0x51, h32]), Script([0x60, h20])):
+            self.assertTrue(es_programa_testigo(script_pubkey.cuerpo()))
+            self.assertFalse(evaluar_gasto(Script([]), script_pubkey, 0))
+        # tampoco envuelto en p2sh
+        redeem_script = Script([0, h20]).serializar()[1:]
+        script_pubkey = Script([0xa9, hash160(redeem_script), 0x87])
+        self.assertTrue((Script([redeem_script]) + script_pubkey).evaluar(0))
+        self.assertFalse(evaluar_gasto(Script([redeem_script]), script_pubkey, 0))
+        for cuerpo in ('0013' + '00' * 20, '0001ff', '6114' + '00' * 20, '5129' + '00' * 41):
+            self.assertFalse(es_programa_testigo(bytes.fromhex(cuerpo)))
+
+    def prueba_aritmética(self):
+        for num in (0, 1, -1, 127, 128, -128, 255, 256, -32768, 2**31 - 1, -(2**31 - 1)):
+            self.assertEqual(decodificar_num(codificar_num(num)), num)
+        self.assertEqual(codificar_num(-1), bytes([0x81]))
+        self.assertEqual(codificar_num(128), bytes([0x80, 0x00]))
+        # 2 3 OP_ADD 5 OP_EQUAL
+        self.assertTrue(Script([0x52, 0x53, 0x93, 0x55, 0x87]).evaluar(0))
+        # 2 3 OP_SUB -1 OP_NUMEQUAL
+        self.assertTrue(Script([0x52, 0x53, 0x94, 0x4f, 0x9c]).evaluar(0))
+        # 4 2 6 OP_WITHIN
+        self.assertTrue(Script([0x54, 0x52, 0x56, 0xa5]).evaluar(0))
+        # 5 bytes no son un número válido
+        self.assertFalse(Script([bytes(5), 0x8b]).evaluar(0))
+        # el cero negativo es falso
+        self.assertFalse(Script([bytes([0, 0x80])]).evaluar(0))
+        # OP_TUCK necesita dos elementos: 1 2 OP_TUCK deja 2 1 2
+        self.assertFalse(Script([0x51, 0x7d]).evaluar(0))
+        self.assertTrue(Script([0x51, 0x52, 0x7d, 0x52, 0x87, 0x69, 0x51, 0x87, 0x69, 0x52, 0x87]).evaluar(0))
+        # OP_DUP OP_DUP sobre una pila vacía
+        self.assertFalse(Script([0x76, 0x76]).evaluar(0))
+
+    def prueba_control_flujo(self):
+        # 1 OP_IF 2 OP_ELSE 3 OP_ENDIF 2 OP_EQUAL
+        self.assertTrue(Script([0x51, 0x63, 0x52, 0x67, 0x53, 0x68, 0x52, 0x87]).evaluar(0))
+        # 0 OP_IF 2 OP_ELSE 3 OP_ENDIF 3 OP_EQUAL
+        self.assertTrue(Script([0x00, 0x63, 0x52, 0x67, 0x53, 0x68, 0x53, 0x87]).evaluar(0))
+        # 0 OP_NOTIF 0 OP_IF OP_RETURN OP_ENDIF 7 OP_ENDIF: la rama anidada no se ejecuta
+        self.assertTrue(Script([0x00, 0x64, 0x00, 0x63, 0x6a, 0x68, 0x57, 0x68]).evaluar(0))
+        # op codes desactivados, OP_VERIF y pushes demasiado grandes invalidan
+        # el script aunque estén en una rama que no se ejecuta
+        for cosa in (0x7e, 0x65, 0x66, 0x95, bytes(MÁXIMO_ELEMENTO + 1)):
+            self.assertFalse(Script([0x00, 0x63, cosa, 0x68, 0x51]).evaluar(0))
+        self.assertTrue(Script([0x00, 0x63, bytes(MÁXIMO_ELEMENTO), 0x6a, 0x68, 0x51]).evaluar(0))
+        # OP_IF sin OP_ENDIF, OP_ENDIF sin OP_IF y OP_RETURN
+        self.assertFalse(Script([0x51, 0x51, 0x63]).evaluar(0))
+        self.assertFalse(Script([0x51, 0x68]).evaluar(0))
+        self.assertFalse(Script([0x51, 0x6a]).evaluar(0))
+        # la pila tiene un máximo de elementos
+        self.assertTrue(Script([0x51] * MÁXIMO_PILA).evaluar(0))
+        self.assertFalse(Script([0x51] * (MÁXIMO_PILA + 1)).evaluar(0))
+        self.assertFalse(Script([]).evaluar(0))
+
+
 OP_CODES = {
     0: 'OP_0',
     76: 'OP_PUSHDATA1',
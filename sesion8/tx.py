@@ -1,19 +1,23 @@
 from io import BytesIO
 from unittest import TestCase
 
+import copy
+import pickle
+
 import requests
 
-from cce import ClavePrivada, PuntoS256, Firma
+from cce import ClavePrivada, PuntoS256, Firma, verificar_lote
 from ayudante import (
     decodificar_base58,
     doble_sha256,
-    codificar_varint,
-    int_a_little_endian,
+    hash160,
     little_endian_a_int,
-    read_varint,
+    a_lector,
+    EscritorBytes,
+    LectorBytes,
     SIGHASH_ALL,
 )
-from script import script_p2pkh, Script
+from script import evaluar_gasto, script_p2pkh, Script
 
 
 class Tx:
@@ -48,45 +52,51 @@ class Tx:
         '''Toma un stream de bytes y parsea la transacción al comienzo
         devuelve un objeto Tx
         '''
-        # s.read(n) devolverá n bytes
+        # s puede ser bytes, un LectorBytes o cualquier stream
+        s = a_lector(s)
         # versión tiene 4 bytes, little-endian, interpretalo como int
-        versión = little_endian_a_int(s.read(4))
-        # num_inputs es un varint, usa read_varint(s)
-        num_inputs = read_varint(s)
+        versión = s.read_u32()
+        # num_inputs es un varint
+        num_inputs = s.read_varint()
         # cada input necesita parseo
         inputs = []
         for _ in range(num_inputs):
             inputs.append(TxIn.parsear(s))
-        # num_outputs es un varint, usa read_varint(s)
-        num_outputs = read_varint(s)
+        # num_outputs es un varint
+        num_outputs = s.read_varint()
         # cada output necesita parseo
         outputs = []
         for _ in range(num_outputs):
             outputs.append(TxOut.parsear(s))
         # locktime es 4 bytes, little-endian
-        locktime = little_endian_a_int(s.read(4))
+        locktime = s.read_u32()
         # devuelve una instancia de la clase (cls(...))
         return cls(versión, inputs, outputs, locktime, testnet=testnet)
 
     def serializar(self):
         '''Devuelve la serialización en bytes de la transacción'''
+        escritor = EscritorBytes()
+        self.serializar_en(escritor)
+        return escritor.getvalue()
+
+    def serializar_en(self, escritor):
+        '''Escribe la transacción en el EscritorBytes'''
         # serializar versión (4 bytes, little endian)
-        res = int_a_little_endian(self.versión, 4)
-        # codificar_varint sobre el número de inputs
-        res += codificar_varint(len(self.tx_ins))
+        escritor.write_u32_le(self.versión)
+        # varint con el número de inputs
+        escritor.write_varint(len(self.tx_ins))
         # itera los inputs
         for tx_in in self.tx_ins:
-            # serializar cada input
-            res += tx_in.serializar()
-        # codificar_varint sobre el número de outputs
-        res += codificar_varint(len(self.tx_outs))
+            # serializar cada input en el mismo escritor
+            tx_in.serializar_en(escritor)
+        # varint con el número de outputs
+        escritor.write_varint(len(self.tx_outs))
         # itera outputs
         for tx_out in self.tx_outs:
-            # serializar cada output
-            res += tx_out.serializar()
+            # serializar cada output en el mismo escritor
+            tx_out.serializar_en(escritor)
         # serializar locktime (4 bytes, little endian)
-        res += int_a_little_endian(self.locktime, 4)
-        return res
+        escritor.write_u32_le(self.locktime)
 
     def comisión(self):
         '''Devuelve la comisión de esta transacción en satoshi'''
@@ -103,9 +113,10 @@ class Tx:
         # devuelve input sum - output sum
         return input_sum - output_sum
 
-    def sig_hash(self, índice_input, tipo_hash):
+    def sig_hash(self, índice_input, tipo_hash, redeem_script=None):
         '''Devuelve la representación entera del hash que necesita
-        ser verificar_inputdo para índice índice_input'''
+        ser verificar_inputdo para índice índice_input. Para p2sh se
+        firma el redeem_script en lugar del script_pubkey'''
         # crea un nuevo set de tx_ins (alt_tx_ins)
         alt_tx_ins = []
         # itera por self.tx_ins
@@ -119,20 +130,25 @@ class Tx:
             ))
         # obtén el input en el índice_input
         input_verificar_inputnte = alt_tx_ins[índice_input]
-        # obtén el script_pubkey del input
-        script_pubkey = input_verificar_inputnte.script_pubkey(self.testnet)
-        # el script_sig del input_verificar_inputnte debería ser script_pubkey
-        input_verificar_inputnte.script_sig = script_pubkey
+        if redeem_script is None:
+            # obtén el script_pubkey del input
+            script_firmado = input_verificar_inputnte.script_pubkey(self.testnet)
+        else:
+            script_firmado = redeem_script
+        # el script_sig del input_verificar_inputnte debería ser el script firmado
+        input_verificar_inputnte.script_sig = script_firmado
         # crea una transacción alternativa con el tx_ins modificado
         alt_tx = self.__class__(
             versión=self.versión,
             tx_ins=alt_tx_ins,
             tx_outs=self.tx_outs,
             locktime=self.locktime)
-        # añade tipo_hash int 4 bytes, little endian
-        res = alt_tx.serializar() + int_a_little_endian(tipo_hash, 4)
+        # serializa la tx alternativa y añade tipo_hash int 4 bytes, little endian
+        escritor = EscritorBytes()
+        alt_tx.serializar_en(escritor)
+        escritor.write_u32_le(tipo_hash)
         # obtén el doble_sha256 de la serialización de la tx
-        s256 = doble_sha256(res)
+        s256 = doble_sha256(escritor.datos)
         # convierte esto a big-endian entero usando int.from_bytes(x, 'big')
         return int.from_bytes(s256, 'big')
 
@@ -140,16 +156,53 @@ class Tx:
         '''Devuelve si el input tiene una firma válida'''
         # obtén el input relevante
         tx_in = self.tx_ins[índice_input]
-        # parsea el punto desde el formato sec (tx_in.sec_pubkey())
-        punto = PuntoS256.parsear(tx_in.sec_pubkey())
-        # parsea la firma desde el formato der (tx_in.firma_der())
-        firma = Firma.parsear(tx_in.firma_der())
-        # obtén el tipo hash desde el input (tx_in.tipo_hash())
-        tipo_hash = tx_in.tipo_hash()
-        # obtén el sig_hash (z)
-        z = self.sig_hash(índice_input, tipo_hash)
-        # usa punto.verificar sobre z y la firma
-        return punto.verificar(z, firma)
+        # obtén el script_pubkey del output que gasta
+        script_pubkey = tx_in.script_pubkey(testnet=self.testnet)
+        # en p2sh las firmas son del redeem script, el último elemento del script_sig
+        redeem_script = None
+        clase = script_pubkey.clasificar()
+        if clase is not None and clase[0] == 'p2sh':
+            cosas = tx_in.script_sig.cosas
+            if not cosas or type(cosas[-1]) == int:
+                return False
+            redeem_script = Script(bruto=cosas[-1])
+        # el sig_hash (z) depende del tipo hash de cada firma: calcúlalo
+        # solo la primera vez que aparece cada tipo
+        zs = {}
+
+        def z(tipo_hash):
+            if tipo_hash not in zs:
+                zs[tipo_hash] = self.sig_hash(índice_input, tipo_hash, redeem_script)
+            return zs[tipo_hash]
+
+        # ejecuta el script_sig seguido del script_pubkey (y del redeem script)
+        return evaluar_gasto(tx_in.script_sig, script_pubkey, z)
+
+    def verificar(self):
+        '''Devuelve si todos los inputs tienen firmas válidas'''
+        elementos = []
+        # itera por los inputs
+        for índice_input, tx_in in enumerate(self.tx_ins):
+            clase = tx_in.script_pubkey(self.testnet).clasificar()
+            cosas = tx_in.script_sig.cosas
+            # un p2pkh gastado con [firma, sec] de la sec correcta se reduce a
+            # verificar la firma: esas se verifican todas juntas en lote
+            if clase is not None and clase[0] == 'p2pkh' and len(cosas) == 2 \
+                    and type(cosas[0]) == bytes and type(cosas[1]) == bytes \
+                    and cosas[0] and hash160(cosas[1]) == clase[1]:
+                try:
+                    punto = PuntoS256.parsear(cosas[1])
+                    firma = Firma.parsear(cosas[0][:-1])
+                except (IndexError, RuntimeError, ValueError):
+                    # como en Script.evaluar, una sec o una firma mal codificadas no validan
+                    return False
+                z = self.sig_hash(índice_input, cosas[0][-1])
+                elementos.append((punto, z, firma))
+            # el resto de inputs se ejecutan como en verificar_input
+            elif not self.verificar_input(índice_input):
+                return False
+        # verifica todas las firmas de una vez
+        return all(verificar_lote(elementos))
 
     def firmar_input(self, índice_input, clave_privada, tipo_hash):
         '''Firma el input usando la clave privada'''
@@ -219,35 +272,39 @@ class TxIn:
         '''Toma un stream de bytes y parsea la tx_input al comienzo
         devuelve un objeto TxIn
         '''
-        # s.read(n) devolverá n bytes
+        s = a_lector(s)
         # tx_previa es 32 bytes, little endian
-        tx_previa = s.read(32)[::-1]
+        tx_previa = s.read_hash()
         # índice_previo es 4 bytes, little endian, interpretalo como int
-        índice_previo = little_endian_a_int(s.read(4))
+        índice_previo = s.read_u32()
         # script_sig es un campo variable (longitud seguida de los datos)
         # puedes usar Script.parsear para obtener el auténtico script
         script_sig = Script.parsear(s)
         # sequence es 4 bytes, little-endian, interpretalo comos int
-        sequence = little_endian_a_int(s.read(4))
+        sequence = s.read_u32()
         # devuelve una instancia de la clase (cls(...))
         return cls(tx_previa, índice_previo, script_sig, sequence)
 
     def serializar(self):
         '''Devuelve la serialización en bytes del input de la transacción'''
+        escritor = EscritorBytes()
+        self.serializar_en(escritor)
+        return escritor.getvalue()
+
+    def serializar_en(self, escritor):
+        '''Escribe el input de la transacción en el EscritorBytes'''
         # serializar tx_previa, little endian
-        res = self.tx_previa[::-1]
+        escritor.write_hash(self.tx_previa)
         # serializar índice_previo, 4 bytes, little endian
-        res += int_a_little_endian(self.índice_previo, 4)
+        escritor.write_u32_le(self.índice_previo)
         # serializar el script_sig
-        res += self.script_sig.serializar()
+        self.script_sig.serializar_en(escritor)
         # serializar sequence, 4 bytes, little endian
-        res += int_a_little_endian(self.sequence, 4)
-        return res
+        escritor.write_u32_le(self.sequence)
 
     @classmethod
     def crea_cache(cls, tx_id, bruto):
-        stream = BytesIO(bruto)
-        tx = Tx.parsear(stream)
+        tx = Tx.parsear(LectorBytes(bruto))
         cls.cache[tx_id] = tx
 
     @classmethod
@@ -266,8 +323,7 @@ class TxIn:
             if bruto[4] == 0:
                  # esto es segwit, así que conviértelo en no-segwit
                 bruto = bruto[:4] + bruto[6:]
-            stream = BytesIO(bruto)
-            tx = Tx.parsear(stream)
+            tx = Tx.parsear(LectorBytes(bruto))
             self.cache[self.tx_previa] = tx
         return self.cache[self.tx_previa]
 
@@ -324,9 +380,9 @@ class TxOut:
         '''Toma un stream de bytes y parsea el tx_output al comienzo
         devuelve un objeto TxOut
         '''
-        # s.read(n) devolverá n bytes
+        s = a_lector(s)
         # cantidad es 8 bytes, little endian, interpretalo como int
-        cantidad = little_endian_a_int(s.read(8))
+        cantidad = s.read_u64()
         # script_pubkey es un campo variable (longitud seguida de los datos)
         # puedes usar Script.parsear para obtener el script auténtico
         script_pubkey = Script.parsear(s)
@@ -335,15 +391,71 @@ class TxOut:
 
     def serializar(self):
         '''Devuelve la serialización en bytes del output de la transacción'''
+        escritor = EscritorBytes()
+        self.serializar_en(escritor)
+        return escritor.getvalue()
+
+    def serializar_en(self, escritor):
+        '''Escribe el output de la transacción en el EscritorBytes'''
         # serializar cantidad, 8 bytes, little endian
-        res = int_a_little_endian(self.cantidad, 8)
+        escritor.write_u64_le(self.cantidad)
         # serializar el script_pubkey
-        res += self.script_pubkey.serializar()
-        return res
+        self.script_pubkey.serializar_en(escritor)
 
 
 class PruebaTx(TestCase):
 
+    def prueba_verificar_p2sh(self):
+        clave = ClavePrivada(8675309)
+        multisig = [ClavePrivada(secreto) for secreto in (11, 22)]
+        redeem_script = Script([0x52] + [c.punto.sec() for c in multisig] + [0x52, 0xae])
+        cuerpo = redeem_script.serializar()[1:]
+        # una tx previa en la caché, para no ir a la red
+        previa = Tx(1, [], [
+            TxOut(1000, script_p2pkh(hash160(clave.punto.sec()))),
+            TxOut(2000, Script([0xa9, hash160(cuerpo), 0x87])),
+        ], 0)
+        id_previa = bytes(range(32))
+        TxIn.cache[id_previa] = previa
+        self.addCleanup(TxIn.cache.pop, id_previa)
+        tx = Tx(1, [
+            TxIn(id_previa, 0, Script([]), 0xffffffff),
+            TxIn(id_previa, 1, Script([cuerpo]), 0xffffffff),
+        ], [TxOut(2500, script_p2pkh(bytes(20)))], 0)
+        self.assertTrue(tx.firmar_input(0, clave, SIGHASH_ALL))
+        # gastar el p2sh sin ninguna firma no vale
+        self.assertFalse(tx.verificar_input(1))
+        self.assertFalse(tx.verificar())
+        z = tx.sig_hash(1, SIGHASH_ALL, redeem_script)
+        firmas = [c.firmar(z).der() + bytes([SIGHASH_ALL]) for c in multisig]
+        tx.tx_ins[1].script_sig = Script([0] + firmas + [cuerpo])
+        self.assertTrue(tx.verificar_input(1))
+        self.assertTrue(tx.verificar())
+        # una sec que no es la del p2pkh falla igual en lote que uno a uno
+        firma = tx.tx_ins[0].script_sig.cosas[0]
+        tx.tx_ins[0].script_sig = Script([firma, multisig[0].punto.sec()])
+        self.assertFalse(tx.verificar_input(0))
+        self.assertFalse(tx.verificar())
+
+    def prueba_verificar_testigo(self):
+        h160 = bytes(range(20))
+        redeem_script = Script([0, h160])
+        cuerpo = redeem_script.serializar()[1:]
+        previa = Tx(1, [], [
+            TxOut(1000, Script([0, h160])),
+            TxOut(1000, Script([0x51, bytes(range(32))])),
+            TxOut(1000, Script([0xa9, hash160(cuerpo), 0x87])),
+        ], 0)
+        id_previa = bytes(range(1, 33))
+        TxIn.cache[id_previa] = previa
+        self.addCleanup(TxIn.cache.pop, id_previa)
+        # p2wpkh y p2tr con el script_sig vacío, p2sh-p2wpkh solo con el redeem script
+        for índice, script_sig in ((0, Script([])), (1, Script([])), (2, Script([cuerpo]))):
+            tx = Tx(1, [TxIn(id_previa, índice, script_sig, 0xffffffff)],
+                    [TxOut(500, script_p2pkh(bytes(20)))], 0)
+            self.assertFalse(tx.verificar_input(0))
+            self.assertFalse(tx.verificar())
+
     def prueba_parsear_versión(self):
         tx_bruta = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
         stream = BytesIO(tx_bruta)
@@ -405,6 +517,25 @@ class PruebaTx(TestCase):
         tx = Tx.parsear(stream)
         self.assertEqual(tx.serializar(), tx_bruta)
 
+    def prueba_parsear_lector(self):
+        tx_bruta = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
+        # dos txs seguidas: el lector tiene que quedar justo al final de la primera
+        lector = LectorBytes(tx_bruta * 2)
+        for _ in range(2):
+            tx = Tx.parsear(lector)
+            self.assertEqual(tx.serializar(), tx_bruta)
+        self.assertEqual(lector.restantes(), 0)
+        self.assertEqual(Tx.parsear(tx_bruta).serializar(), tx_bruta)
+
+    def prueba_copiar(self):
+        tx_bruta = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
+        buffer = bytearray(tx_bruta)
+        tx = Tx.parsear(buffer)
+        # el buffer no queda bloqueado por los scripts de la tx
+        buffer += b'x'
+        self.assertEqual(copy.deepcopy(tx).serializar(), tx_bruta)
+        self.assertEqual(pickle.loads(pickle.dumps(tx)).serializar(), tx_bruta)
+
     def prueba_valor_input(self):
         tx_hash = 'd1c789a9c60383bf715f3f6ad9d14b91fe55f3deb369fe5d9280cb1a01793f81'
         index = 0
@@ -453,6 +584,12 @@ class PruebaTx(TestCase):
         tx = Tx.parsear(stream)
         self.assertTrue(tx.verificar_input(0))
 
+    def prueba_verificar(self):
+        tx_bruta = bytes.fromhex('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
+        stream = BytesIO(tx_bruta)
+        tx = Tx.parsear(stream)
+        self.assertTrue(tx.verificar())
+
     def prueba_firmar_input(self):
         clave_privada = ClavePrivada(secreto=8675309)
         tx_ins = []